@@ -14,39 +14,366 @@
 
 """Helper function for writing ionit plugins"""
 
+import abc
+import collections
+import functools
 import logging
+import os
+import threading
+import time
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "uncacheable", "maxsize", "currsize"]
+)
+
+
+def _freeze(value):
+    """Convert lists, tuples, dicts, and sets recursively into hashable tuples
+
+    The type is included to not mix up for example a list and a tuple with the
+    same items.
+    """
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(item) for item in value))
+    if isinstance(value, dict):
+        return (type(value), tuple((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return (type(value), frozenset(_freeze(item) for item in value))
+    return value
+
+
+def memoize(func, maxsize=128):
+    """Wrap the given function in a least-recently-used cache with up to maxsize entries
+
+    In contrast to functools.lru_cache, lists, dicts, and sets are supported as
+    arguments (by converting them into hashable keys). Calls with other
+    unhashable arguments (like Jinja's Undefined objects) are passed through and
+    counted as uncacheable. Coroutine functions are supported as well. If maxsize
+    is None, the cache can grow without bound. The cache statistics are returned
+    by the cache_info function attribute and cache_clear empties the cache.
+    """
+    import inspect  # pylint: disable=import-outside-toplevel
+
+    cache = collections.OrderedDict()
+    stats = collections.Counter()
+    lock = threading.Lock()
+
+    def make_key(args, kwargs):
+        try:
+            key = _freeze((args, kwargs))
+            hash(key)
+        except Exception:  # pylint: disable=broad-except
+            with lock:
+                stats["uncacheable"] += 1
+            return None
+        return key
+
+    def lookup(key):
+        with lock:
+            if key in cache:
+                cache.move_to_end(key)
+                stats["hits"] += 1
+                return True, cache[key]
+            stats["misses"] += 1
+        return False, None
+
+    def store(key, result):
+        with lock:
+            cache[key] = result
+            if maxsize is not None and len(cache) > maxsize:
+                cache.popitem(last=False)
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            if key is None:
+                return await func(*args, **kwargs)
+            found, result = lookup(key)
+            if not found:
+                result = await func(*args, **kwargs)
+                store(key, result)
+            return result
+
+    else:
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            if key is None:
+                return func(*args, **kwargs)
+            found, result = lookup(key)
+            if not found:
+                result = func(*args, **kwargs)
+                store(key, result)
+            return result
+
+    def cache_info():
+        with lock:
+            return CacheInfo(
+                stats["hits"], stats["misses"], stats["uncacheable"], maxsize, len(cache)
+            )
+
+    def cache_clear():
+        with lock:
+            cache.clear()
+            stats.clear()
+
+    wrapper.cache_info = cache_info
+    wrapper.cache_clear = cache_clear
+    return wrapper
 
 
 class FunctionCollector:
-    """Collect functions for the Jinja renderer"""
+    """Collect functions for the Jinja renderer
+
+    The functions are collected per thread, so that Python modules can be
+    imported concurrently in different threads.
+    """
 
-    functions = {}
+    _lock = threading.Lock()
+    _local = threading.local()
 
     def __new__(cls):
         # Singleton
-        if not hasattr(cls, "instance") or not cls.instance:
-            cls.instance = super().__new__(cls)
+        with cls._lock:
+            if not hasattr(cls, "instance") or not cls.instance:
+                cls.instance = super().__new__(cls)
         return cls.instance
 
+    @property
+    def functions(self):
+        """Functions collected by the current thread since the last clear() call"""
+        try:
+            return self._local.functions
+        except AttributeError:
+            self._local.functions = {}
+            return self._local.functions
+
     def clear(self):
         """Reset the list of functions
 
         Call this method between importing different modules.
         """
-        self.functions = {}
+        self._local.functions = {}
 
-    def function(self, func):
+    def function(self, func=None, *, cache=False, maxsize=128):
         """Function decorator to collect functions for Jinja rendering
 
         Functions using this decorator will be collected and ionit will
         use them in the context to make these functions available for
         the Jinja template rendering.
 
+        The decorator can be called with arguments: If cache is set, the
+        results of the function are memoized in a least-recently-used cache
+        with up to maxsize entries (see memoize). Since the Python modules are
+        imported on each run, the cache lives for one ionit run.
         """
+        if func is None:
+            return functools.partial(self.function, cache=cache, maxsize=maxsize)
         logger = logging.getLogger(__name__)
         logger.debug("Collecting function '%s'.", func.__name__)
+        if cache:
+            func = memoize(func, maxsize)
         self.functions[func.__name__] = func
         return func
 
 
 function = FunctionCollector().function  # false positive, pylint: disable=invalid-name
+
+
+class ConfigLoader(abc.ABC):  # pylint: disable=too-few-public-methods
+    """Base class for loaders of static configuration files
+
+    A loader has the name of the file format (used in log messages), a tuple
+    of exceptions that it raises for invalid files, and a load method that
+    takes the filename and the encoding and returns the parsed content.
+    """
+
+    name = None
+    errors = (ValueError,)
+
+    @abc.abstractmethod
+    def load(self, filename, encoding):
+        """Read the given configuration file and return its content"""
+
+
+CONFIG_LOADERS = {}
+
+
+def register_loader(extension, loader):
+    """Register a loader for configuration files with the given extension
+
+    The extension includes the leading dot (e.g. ".toml") and the loader is a
+    ConfigLoader object. Registering a loader for an extension that already has
+    a loader replaces it. Since the configuration files are read in alphabetical
+    order, the loader is only used for files that are read after the Python
+    module that registers it.
+    """
+    logger = logging.getLogger(__name__)
+    logger.debug("Registering %s loader for '%s' files.", loader.name, extension)
+    CONFIG_LOADERS[extension] = loader
+
+
+# Directory for cached_context (set by ionit's --plugin-cache option)
+CONTEXT_CACHE_DIRECTORY = None
+CONTEXT_CACHE_VERSION = 1
+
+
+def _fingerprint(path):
+    """Return the size and modification time of the given file (or None if it is missing)"""
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+    return (file_stat.st_size, file_stat.st_mtime_ns)
+
+
+class _CachedContext:
+    """Entry in the context cache for the given key"""
+
+    def __init__(self, key, ttl, files):
+        self.key = key
+        self.ttl = ttl
+        self.filename = None
+        self.fingerprints = None
+        if CONTEXT_CACHE_DIRECTORY:
+            import hashlib  # pylint: disable=import-outside-toplevel
+
+            digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+            self.filename = os.path.join(CONTEXT_CACHE_DIRECTORY, f"{digest}.pickle")
+            # Taken before calling collect_context to not miss changes while it runs
+            self.fingerprints = {path: _fingerprint(path) for path in files}
+
+    def load(self):
+        """Return the cached context or None if there is no valid cache entry"""
+        if not self.filename:
+            return None
+        import pickle  # pylint: disable=import-outside-toplevel
+
+        logger = logging.getLogger(__name__)
+        try:
+            with open(self.filename, "rb") as cache_file:
+                entry = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Failed to read cached context '%s': %s", self.filename, error)
+            return None
+        if not self.is_valid(entry):
+            return None
+        age = time.time() - entry["created"]
+        logger.info("Using cached context for '%s' (%i seconds old).", self.key, age)
+        return entry["context"]
+
+    def is_valid(self, entry):
+        """Check if the given cache entry is neither expired nor outdated"""
+        if not isinstance(entry, dict) or entry.get("version") != CONTEXT_CACHE_VERSION:
+            return False
+        if entry.get("key") != self.key:
+            return False
+        logger = logging.getLogger(__name__)
+        age = time.time() - entry["created"]
+        if self.ttl is not None and not 0 <= age < self.ttl:
+            logger.debug("Cached context for '%s' expired.", self.key)
+            return False
+        if entry["files"] != self.fingerprints:
+            logger.debug("Input files of the cached context for '%s' changed.", self.key)
+            return False
+        return True
+
+    def save(self, context):
+        """Store the given context in the cache (atomically)"""
+        if not self.filename:
+            return
+        import pickle  # pylint: disable=import-outside-toplevel
+        import tempfile  # pylint: disable=import-outside-toplevel
+
+        logger = logging.getLogger(__name__)
+        entry = {
+            "version": CONTEXT_CACHE_VERSION,
+            "key": self.key,
+            "created": time.time(),
+            "files": self.fingerprints,
+            "context": context,
+        }
+        temp_name = None
+        try:
+            os.makedirs(CONTEXT_CACHE_DIRECTORY, exist_ok=True)
+            fd, temp_name = tempfile.mkstemp(
+                dir=CONTEXT_CACHE_DIRECTORY, prefix=".", suffix=".tmp"
+            )
+            with os.fdopen(fd, "wb") as cache_file:
+                pickle.dump(entry, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_name, self.filename)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Failed to cache context for '%s': %s", self.key, error)
+            if temp_name and os.path.exists(temp_name):
+                os.remove(temp_name)
+
+
+def cached_context(ttl=None, key=None, files=()):
+    """Decorator to cache the context returned by collect_context across runs
+
+    The returned context is stored in CONTEXT_CACHE_DIRECTORY (set by ionit's
+    --plugin-cache option) and reused until it is older than ttl seconds (it
+    never expires if ttl is None) or until one of the given input files changes
+    (size or modification time). The key identifies the cache entry and
+    defaults to the file and name of the decorated function. It can also be a
+    function that takes the current context and returns the key. Without a
+    cache directory, the decorated function is always called.
+    """
+
+    def decorator(func):
+        import inspect  # pylint: disable=import-outside-toplevel
+
+        def get_entry(current_context):
+            if key is None:
+                entry_key = f"{func.__code__.co_filename}:{func.__qualname__}"
+            else:
+                entry_key = key(current_context) if callable(key) else key
+            return _CachedContext(entry_key, ttl, files)
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(current_context):
+                entry = get_entry(current_context)
+                context = entry.load()
+                if context is None:
+                    context = await func(current_context)
+                    entry.save(context)
+                return context
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(current_context):
+                entry = get_entry(current_context)
+                context = entry.load()
+                if context is None:
+                    context = func(current_context)
+                    entry.save(context)
+                return context
+
+        return wrapper
+
+    return decorator
+
+
+def flush_context_cache(directory):
+    """Remove all entries of the context cache in the given directory
+
+    Return the number of removed entries. Raise OSError on failure.
+    """
+    try:
+        filenames = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for filename in filenames:
+        if filename.endswith(".pickle"):
+            os.remove(os.path.join(directory, filename))
+            removed += 1
+    return removed
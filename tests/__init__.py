@@ -16,6 +16,7 @@
 
 import inspect
 import os
+import tempfile
 import unittest
 
 
@@ -42,6 +43,29 @@ def get_source_files():
     return files
 
 
+class TemporaryTreeTestCase(unittest.TestCase):
+    """Test case working on files in a temporary directory (removed after each test)."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def _mkdir(self, name):
+        """Create the given directory (relative to the temporary directory). Return its path."""
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _write(self, name, content):
+        """Write the file (relative to the temporary directory). Return its path."""
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as output_file:
+            output_file.write(content)
+        return path
+
+
 def unittest_verbosity():
     """
     Return the verbosity setting of the currently running unittest.
@@ -0,0 +1,277 @@
+# Copyright (C) 2026, Benjamin Drung <bdrung@posteo.de>
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""Benchmark collecting the context and rendering the templates
+
+Run it from the top directory: python3 -m tests.benchmark
+
+The workload is generated deterministically from the given sizes. Store the
+results of a known good version with --output and compare later runs against
+it with --baseline (on the same machine) to spot performance regressions.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import ionit
+
+RESULTS_VERSION = 1
+
+PLUGIN = """\
+import ionit_plugin
+
+
+def collect_context(context):
+    return {{"plugin{number}": [{{"name": f"service{{i}}", "port": 8000 + i}} for i in range(20)]}}
+
+
+@ionit_plugin.function
+def format_address{number}(name, port):
+    return f"{{name}}.example.com:{{port}}"
+"""
+
+TEMPLATE = """\
+{{% include "header.inc" %}}
+{{% for key, value in settings{config}.items() %}}
+{{{{ key }}}} = {{{{ value.address }}}} ({{{{ value.roles | join(", ") }}}})
+{{% endfor %}}
+{{% for service in plugin{plugin} %}}
+{{{{ format_address{plugin}(service.name, service.port) }}}}
+{{% endfor %}}
+"""
+
+HEADER = "# Generated by ionit for {{ plugin0 | length }} services\n"
+
+
+def generate_settings(number, entries):
+    """Generate the content of one configuration file with the given number of entries"""
+    return {
+        f"settings{number}": {
+            f"key{entry:05d}": {
+                "address": f"10.{number % 256}.{entry // 256 % 256}.{entry % 256}",
+                "roles": ["web", "database"] if entry % 2 else ["storage"],
+                "enabled": bool(entry % 3),
+            }
+            for entry in range(entries)
+        }
+    }
+
+
+def write_yaml(data, filename):
+    """Write the given two-level data as YAML (without depending on a YAML emitter)"""
+    with open(filename, "w", encoding="utf-8") as yaml_file:
+        yaml_file.write("---\n")
+        for name, settings in data.items():
+            yaml_file.write(f"{name}:\n")
+            for key, value in settings.items():
+                yaml_file.write(f"  {key}: {json.dumps(value)}\n")
+
+
+def generate_workload(directory, configs, entries, plugins, templates):
+    """Generate configuration files, Python modules, and templates in the given directory
+
+    Half of the configuration files are JSON and half of them are YAML. Each
+    template includes a header, loops over one configuration file and one
+    Python module context, and calls a function exported by the Python module.
+    Return the configuration and template directory.
+    """
+    config_dir = os.path.join(directory, "config")
+    template_dir = os.path.join(directory, "templates")
+    os.makedirs(config_dir)
+    os.makedirs(template_dir)
+    for number in range(configs):
+        data = generate_settings(number, entries)
+        if number % 2:
+            write_yaml(data, os.path.join(config_dir, f"settings{number:04d}.yaml"))
+        else:
+            with open(
+                os.path.join(config_dir, f"settings{number:04d}.json"), "w", encoding="utf-8"
+            ) as json_file:
+                json.dump(data, json_file, indent=2)
+    for number in range(plugins):
+        with open(
+            os.path.join(config_dir, f"plugin{number:04d}.py"), "w", encoding="utf-8"
+        ) as plugin_file:
+            plugin_file.write(PLUGIN.format(number=number))
+    with open(os.path.join(template_dir, "header.inc"), "w", encoding="utf-8") as header_file:
+        header_file.write(HEADER)
+    for number in range(templates):
+        template = TEMPLATE.format(config=number % configs, plugin=number % plugins)
+        subdir = os.path.join(template_dir, f"dir{number % 10}")
+        os.makedirs(subdir, exist_ok=True)
+        with open(
+            os.path.join(subdir, f"file{number:04d}.jinja"), "w", encoding="utf-8"
+        ) as template_file:
+            template_file.write(template)
+    return config_dir, template_dir
+
+
+def measure(function, repeat):
+    """Call the function repeat times and return the timings in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        failures = function()
+        timings.append(time.perf_counter() - start)
+        if failures:
+            raise RuntimeError(f"Benchmarked function failed: {failures}")
+    return timings
+
+
+def run_benchmarks(config_dir, template_dir, repeat):
+    """Time collect_context(), render_templates(), and main(). Return the results."""
+    context = ionit.collect_context([config_dir], "utf-8")[1]
+    benchmarks = {
+        "collect_context": lambda: ionit.collect_context([config_dir], "utf-8")[0],
+        "render_templates": lambda: ionit.render_templates(
+            template_dir, context, "jinja", "utf-8"
+        ),
+        "main": lambda: ionit.main(["-q", "-c", config_dir, "-t", template_dir]),
+    }
+    results = {}
+    for name, function in benchmarks.items():
+        # Warm up once (imports and first writes of the rendered files)
+        measure(function, 1)
+        timings = measure(function, repeat)
+        results[name] = {
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "timings": timings,
+        }
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Compare the results with the baseline and print a table
+
+    Return the names of the benchmarks whose median time is more than
+    threshold (a fraction) slower than in the baseline.
+    """
+    regressions = []
+    print(f"{'Benchmark':<20} {'Baseline':>10} {'Current':>10} {'Change':>8}")
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<20} {'(missing)':>10} {result['median'] * 1000:>8.1f}ms")
+            continue
+        before = baseline["results"][name]["median"]
+        ratio = result["median"] / before
+        marker = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            marker = " REGRESSION"
+        print(
+            f"{name:<20} {before * 1000:>8.1f}ms {result['median'] * 1000:>8.1f}ms "
+            f"{(ratio - 1) * 100:>+7.1f}%{marker}"
+        )
+    return regressions
+
+
+def parse_args(argv):
+    """Parse the command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument(
+        "--configs",
+        type=int,
+        default=20,
+        help="Number of JSON and YAML configuration files (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--entries",
+        type=int,
+        default=500,
+        help="Number of entries per configuration file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--plugins",
+        type=int,
+        default=10,
+        help="Number of Python modules (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--templates",
+        type=int,
+        default=200,
+        help="Number of templates (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of repetitions (median counts) (default: %(default)s)",
+    )
+    parser.add_argument("-o", "--output", metavar="FILE", help="Write the results as JSON")
+    parser.add_argument(
+        "-b", "--baseline", metavar="FILE", help="Compare the results to the given JSON results"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="Report a regression if a benchmark is more than the given percentage "
+        "slower than the baseline (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+    for option in ("configs", "plugins", "repeat"):
+        if getattr(args, option) < 1:
+            parser.error(f"argument --{option}: must be at least 1")
+    return args
+
+
+def main(argv):
+    """Generate the workload, run the benchmarks, and compare them to the baseline"""
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format=ionit.LOG_FORMAT)
+    workload = {
+        "configs": args.configs,
+        "entries": args.entries,
+        "plugins": args.plugins,
+        "templates": args.templates,
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        config_dir, template_dir = generate_workload(directory, **workload)
+        results = {
+            "version": RESULTS_VERSION,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "workload": workload,
+            "results": run_benchmarks(config_dir, template_dir, args.repeat),
+        }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+            output_file.write("\n")
+
+    if not args.baseline:
+        print(f"{'Benchmark':<20} {'Min':>10} {'Median':>10}")
+        for name, result in results["results"].items():
+            print(f"{name:<20} {result['min'] * 1000:>8.1f}ms {result['median'] * 1000:>8.1f}ms")
+        return 0
+    with open(args.baseline, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get("workload") != workload:
+        print(f"Warning: The baseline used a different workload: {baseline.get('workload')}")
+    return 1 if compare(results, baseline, args.threshold / 100) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,111 @@
+# Copyright (C) 2026, Benjamin Drung <bdrung@posteo.de>
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""Benchmark the backends for reading JSON and YAML configuration files
+
+Run it from the top directory: python3 -m tests.benchmark_loaders
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import ionit
+
+
+def generate_inventory(entries):
+    """Generate a host inventory with the given number of entries"""
+    return {
+        "hosts": {
+            f"host{number:05d}": {
+                "address": f"10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}",
+                "interfaces": [f"eth{interface}" for interface in range(4)],
+                "roles": ["web", "database"] if number % 2 else ["storage"],
+                "managed": bool(number % 3),
+                "weight": number / 7,
+            }
+            for number in range(entries)
+        }
+    }
+
+
+def write_yaml(data, filename):
+    """Write the given data as YAML (without depending on a YAML emitter)"""
+    with open(filename, "w", encoding="utf-8") as yaml_file:
+        yaml_file.write("---\nhosts:\n")
+        for host, attributes in data["hosts"].items():
+            yaml_file.write(f"  {host}:\n")
+            for key, value in attributes.items():
+                yaml_file.write(f"    {key}: {json.dumps(value)}\n")
+
+
+def benchmark(loader, filename, repeat):
+    """Return the fastest time in seconds of loading the given file"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        loader.load(filename, "utf-8")
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(argv):
+    """Generate large configuration files and time all available backends"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument(
+        "-n",
+        "--entries",
+        type=int,
+        default=20000,
+        help="Number of hosts in the generated inventory (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of repetitions (fastest one counts) (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    data = generate_inventory(args.entries)
+    with tempfile.TemporaryDirectory() as directory:
+        files = {
+            ionit.JsonLoader: os.path.join(directory, "inventory.json"),
+            ionit.YamlLoader: os.path.join(directory, "inventory.yaml"),
+        }
+        with open(files[ionit.JsonLoader], "w", encoding="utf-8") as json_file:
+            json.dump(data, json_file, indent=2)
+        write_yaml(data, files[ionit.YamlLoader])
+
+        print(f"{'Format':<8} {'Backend':<10} {'Size':>10} {'Time':>10}")
+        for loader_class, filename in files.items():
+            size = os.path.getsize(filename)
+            for backend in loader_class.BACKENDS:
+                loader = loader_class(backend)
+                try:
+                    loader.select_backend()
+                except ImportError:
+                    print(f"{loader.name:<8} {backend:<10} {'(not available)':>21}")
+                    continue
+                seconds = benchmark(loader, filename, args.repeat)
+                print(f"{loader.name:<8} {backend:<10} {size:>10} {seconds * 1000:>8.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,9 @@
+import asyncio
+
+REQUIRES = ()
+PROVIDES = ("first",)
+
+
+async def collect_context(_):
+    await asyncio.sleep(0)
+    return {"first": 1}
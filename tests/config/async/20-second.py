@@ -0,0 +1,17 @@
+import asyncio
+
+import ionit_plugin
+
+REQUIRES = ("first",)
+PROVIDES = ("second",)
+
+
+@ionit_plugin.function
+async def double(value):
+    await asyncio.sleep(0)
+    return 2 * value
+
+
+async def collect_context(current_context):
+    await asyncio.sleep(0)
+    return {"second": current_context["first"] + 1}
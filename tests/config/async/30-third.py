@@ -0,0 +1,2 @@
+def collect_context(current_context):
+    return {"third": current_context["first"] + current_context["second"]}
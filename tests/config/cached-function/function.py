@@ -0,0 +1,13 @@
+import ionit_plugin
+
+CALLS = []
+
+
+@ionit_plugin.function(cache=True, maxsize=16)
+def netmask(prefix):
+    CALLS.append(prefix)
+    return ".".join(str((0xFFFFFFFF << (32 - prefix) >> shift) & 0xFF) for shift in (24, 16, 8, 0))
+
+
+def collect_context(_):
+    return {"calls": CALLS}
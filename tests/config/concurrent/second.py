@@ -0,0 +1,9 @@
+import ionit_test_barrier  # provided by the test case
+
+REQUIRES = ()
+PROVIDES = ("second",)
+
+
+def collect_context(_):
+    ionit_test_barrier.wait()
+    return {"second": True}
@@ -0,0 +1,12 @@
+import ionit_plugin
+
+
+class KeyValueLoader(ionit_plugin.ConfigLoader):
+    name = "key-value"
+
+    def load(self, filename, encoding):
+        with open(filename, encoding=encoding) as config_file:
+            return dict(line.strip().split("=", 1) for line in config_file if line.strip())
+
+
+ionit_plugin.register_loader(".conf", KeyValueLoader())
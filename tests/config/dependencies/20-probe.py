@@ -0,0 +1,6 @@
+REQUIRES = ()
+PROVIDES = ("probe",)
+
+
+def collect_context(current_context):
+    return {"probe": sorted(current_context)}
@@ -0,0 +1,6 @@
+REQUIRES = ("number",)
+PROVIDES = ("double", "double_sees")
+
+
+def collect_context(current_context):
+    return {"double": current_context["number"] * 2, "double_sees": sorted(current_context)}
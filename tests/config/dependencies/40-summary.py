@@ -0,0 +1,2 @@
+def collect_context(current_context):
+    return {"summary_sees": sorted(current_context)}
@@ -0,0 +1,5 @@
+REQUIRES = 5
+
+
+def collect_context(_):
+    return {"key": "value"}
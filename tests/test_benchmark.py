@@ -0,0 +1,57 @@
+# Copyright (C) 2026, Benjamin Drung <bdrung@posteo.de>
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""Check that the benchmark suite keeps working (with a tiny workload)."""
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from . import benchmark
+
+TINY_WORKLOAD = ["--configs", "2", "--entries", "5", "--plugins", "1", "--templates", "3"]
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test the benchmark suite"""
+
+    def test_record_and_compare(self):
+        """Test recording results and comparing them against them as baseline"""
+        with tempfile.TemporaryDirectory() as directory:
+            results_filename = os.path.join(directory, "results.json")
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(
+                    benchmark.main(TINY_WORKLOAD + ["-r", "1", "-o", results_filename]), 0
+                )
+            with open(results_filename, encoding="utf-8") as results_file:
+                results = json.load(results_file)
+            self.assertEqual(
+                sorted(results["results"]), ["collect_context", "main", "render_templates"]
+            )
+            with contextlib.redirect_stdout(io.StringIO()):
+                argv = TINY_WORKLOAD + ["-r", "1", "-b", results_filename, "--threshold", "1e6"]
+                self.assertEqual(benchmark.main(argv), 0)
+
+    def test_compare_regression(self):
+        """Test reporting benchmarks that got slower than the threshold"""
+        baseline = {"results": {"fast": {"median": 1.0}, "slow": {"median": 1.0}}}
+        results = {
+            "results": {"fast": {"median": 1.05}, "slow": {"median": 1.2}, "new": {"median": 1.0}}
+        }
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            self.assertEqual(benchmark.compare(results, baseline, 0.1), ["slow"])
+        self.assertIn("REGRESSION", stdout.getvalue())
@@ -14,12 +14,31 @@
 
 """Test ionit"""
 
+# pylint: disable=too-many-lines
+
+import asyncio
+import io
+import json
 import os
+import pstats
 import re
+import resource
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
 import unittest
+import zipfile
 
+import ionit
+import ionit_plugin
 from ionit import collect_context, main, render_templates
 
+from . import TemporaryTreeTestCase
 from .mock_open import mock_open
 
 TESTS_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -60,6 +79,66 @@ class TestCollectContext(unittest.TestCase):
             (0, {"big_number": 1071, "small_number": 7}),
         )
 
+    def test_declared_dependencies(self):
+        """Test: Python modules only get the context they depend on"""
+        expected = {
+            "number": 7,
+            "probe": ["number"],
+            "double": 14,
+            "double_sees": ["number"],
+            "summary_sees": ["double", "double_sees", "number", "probe"],
+        }
+        for jobs in (1, 4):
+            with self.subTest(jobs=jobs):
+                self.assertEqual(
+                    collect_context(
+                        [os.path.join(CONFIG_DIR, "dependencies")], "utf-8", jobs=jobs
+                    ),
+                    (0, expected),
+                )
+
+    def test_concurrent_plugins(self):
+        """Test: Run independent Python modules concurrently"""
+        barrier = threading.Barrier(2, timeout=10)
+        with unittest.mock.patch.dict(sys.modules, {"ionit_test_barrier": barrier}):
+            self.assertEqual(
+                collect_context([os.path.join(CONFIG_DIR, "concurrent")], "utf-8", jobs=2),
+                (0, {"first": True, "second": True}),
+            )
+
+    def test_async_plugins(self):
+        """Test: Run Python modules with asynchronous collect_context functions"""
+        for jobs in (1, 4):
+            with self.subTest(jobs=jobs):
+                failures, context = collect_context(
+                    [os.path.join(CONFIG_DIR, "async")], "utf-8", jobs=jobs
+                )
+                self.assertEqual(failures, 0)
+                self.assertEqual(sorted(context), ["double", "first", "second", "third"])
+                self.assertEqual(
+                    (context["first"], context["second"], context["third"]), (1, 2, 3)
+                )
+
+    def test_function_collector_threads(self):
+        """Test: Functions are collected per thread"""
+        barrier = threading.Barrier(2, timeout=10)
+        collected = {}
+
+        def collect(name):
+            collector = ionit_plugin.FunctionCollector()
+            collector.clear()
+            barrier.wait()
+            collector.function(getattr(os.path, name))
+            barrier.wait()
+            collected[name] = list(collector.functions)
+
+        threads = [threading.Thread(target=collect, args=(n,)) for n in ("basename", "dirname")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(collected, {"basename": ["basename"], "dirname": ["dirname"]})
+
     def test_empty_python_file(self):
         """Test: Run collect_context(["tests/config/empty"])"""
         with self.assertLogs("ionit", level="WARNING") as context_manager:
@@ -105,6 +184,7 @@ class TestCollectContext(unittest.TestCase):
                 ),
             )
 
+    @unittest.mock.patch.dict(ionit.DEFAULT_CONFIG_LOADERS, {".json": ionit.JsonLoader("json")})
     def test_invalid_json(self):
         """Test: Run collect_context(["tests/config/invalid-json"])"""
         with self.assertLogs("ionit", level="ERROR") as context_manager:
@@ -121,6 +201,20 @@ class TestCollectContext(unittest.TestCase):
                 ),
             )
 
+    def test_invalid_declaration(self):
+        """Test: Run collect_context(["tests/config/invalid-declaration"])"""
+        with self.assertLogs("ionit", level="ERROR") as context_manager:
+            self.assertEqual(
+                collect_context([os.path.join(CONFIG_DIR, "invalid-declaration")], "utf-8"),
+                (1, {}),
+            )
+        self.assertEqual(len(context_manager.output), 1)
+        self.assertRegex(
+            context_manager.output[0],
+            "ERROR:ionit:REQUIRES of Python module '[^']*config/invalid-declaration/invalid.py' "
+            "is neither a string nor a list of strings: 5$",
+        )
+
     def test_invalid_python(self):
         """Test: Run collect_context(["tests/config/invalid-python"])"""
         with self.assertLogs("ionit", level="ERROR") as context_manager:
@@ -150,7 +244,8 @@ class TestCollectContext(unittest.TestCase):
                 (
                     "ERROR:ionit:Failed to read YAML from "
                     r"'[^']*config/invalid-yaml/invalid.yaml': mapping values are not allowed "
-                    r"here\s+in \"\S*config/invalid-yaml/invalid.yaml\", line 3, column 14"
+                    r"(here|in this context)\s+"
+                    r"in \"\S*config/invalid-yaml/invalid.yaml\", line 3, column 14"
                 ),
             )
 
@@ -210,6 +305,472 @@ class TestCollectContext(unittest.TestCase):
             )
 
 
+class TestPluginBytecodeCache(TemporaryTreeTestCase):
+    """Test caching the compiled code of the Python modules"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(ionit.set_plugin_bytecode_cache, None)
+        self.config_dir = self._mkdir("config")
+        self.cache_dir = os.path.join(self.directory, "cache")
+        self._write_plugin(1)
+
+    def _write_plugin(self, number):
+        self._write(
+            "config/number.py",
+            f"def collect_context(context):\n    return {{'number': {number}}}\n",
+        )
+
+    def test_cache(self):
+        """Test: Compile the Python module once and use the cached code afterwards"""
+        ionit.set_plugin_bytecode_cache(self.cache_dir)
+        stats = ionit.PLUGIN_BYTECODE_CACHE.stats
+        stats.clear()
+        for _ in range(2):
+            self.assertEqual(collect_context([self.config_dir], "utf-8"), (0, {"number": 1}))
+        self.assertEqual(dict(stats), {"hits": 1, "misses": 1})
+        self.assertEqual(os.listdir(self.config_dir), ["number.py"])
+
+        self._write_plugin(2)
+        self.assertEqual(collect_context([self.config_dir], "utf-8"), (0, {"number": 2}))
+        self.assertEqual(dict(stats), {"hits": 1, "misses": 2})
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_main_compile_plugins(self):
+        """Test main() with --compile-plugins and --plugin-bytecode-cache"""
+        argv = ["-c", self.config_dir, "--plugin-bytecode-cache", self.cache_dir]
+        self.assertEqual(main(argv + ["--compile-plugins"]), 0)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        stats = ionit.PLUGIN_BYTECODE_CACHE.stats
+        stats.clear()
+        template_dir = os.path.join(self.directory, "templates")
+        os.mkdir(template_dir)
+        self.assertEqual(main(argv + ["-t", template_dir]), 0)
+        self.assertEqual(dict(stats), {"hits": 1})
+
+    def test_compile_invalid_plugin(self):
+        """Test: Compile a Python module with a syntax error"""
+        with open(os.path.join(self.config_dir, "invalid.py"), "w", encoding="utf-8") as plugin:
+            plugin.write("def collect_context(context:\n")
+        argv = ["-c", self.config_dir, "--plugin-bytecode-cache", self.cache_dir]
+        with self.assertLogs("ionit", level="ERROR") as context_manager:
+            self.assertEqual(main(argv + ["--compile-plugins"]), 1)
+        self.assertEqual(len(context_manager.output), 1)
+        self.assertRegex(
+            context_manager.output[0],
+            "^ERROR:ionit:Failed to compile Python module '[^']*/invalid.py'",
+        )
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+
+class TestFunctionCache(unittest.TestCase):
+    """Test memoizing the functions exported by Python modules"""
+
+    def test_memoize(self):
+        """Test: Cache the results and count hits and misses"""
+        calls = []
+
+        def add(first, second):
+            calls.append((first, second))
+            return first + second
+
+        memoized = ionit_plugin.memoize(add, maxsize=2)
+        self.assertEqual([memoized(1, 2), memoized(1, 2), memoized(2, 3)], [3, 3, 5])
+        self.assertEqual(calls, [(1, 2), (2, 3)])
+        self.assertEqual(memoized.cache_info(), ionit_plugin.CacheInfo(1, 2, 0, 2, 2))
+        self.assertEqual(memoized.__name__, "add")
+
+    def test_lru_eviction(self):
+        """Test: Evict the least recently used entry"""
+        calls = []
+        memoized = ionit_plugin.memoize(calls.append, maxsize=2)
+        for value in (1, 2, 1, 3, 1, 2):
+            memoized(value)
+        self.assertEqual(calls, [1, 2, 3, 2])
+
+    def test_unhashable_arguments(self):
+        """Test: Cache calls with lists and dicts and pass through other unhashable arguments"""
+        calls = []
+
+        def describe(value):
+            calls.append(value)
+            return str(value)
+
+        memoized = ionit_plugin.memoize(describe)
+        unhashable = types.SimpleNamespace(value=1)
+        for value in ([1, 2], [1, 2], {"a": [1]}, {"a": [1]}, (1, 2), unhashable):
+            memoized(value)
+        self.assertEqual(calls, [[1, 2], {"a": [1]}, (1, 2), unhashable])
+        self.assertEqual(memoized.cache_info(), ionit_plugin.CacheInfo(2, 3, 1, 128, 3))
+
+    def test_coroutine_function(self):
+        """Test: Cache the results of coroutine functions"""
+        calls = []
+
+        async def double(value):
+            calls.append(value)
+            return 2 * value
+
+        memoized = ionit_plugin.memoize(double)
+        loop = asyncio.new_event_loop()
+        try:
+            results = [loop.run_until_complete(memoized(value)) for value in (1, 1, 2)]
+        finally:
+            loop.close()
+        self.assertEqual(results, [2, 2, 4])
+        self.assertEqual(calls, [1, 2])
+
+    def test_render_cached_function(self):
+        """Test: Render a template with a cached function"""
+        template_dir = os.path.join(TEMPLATE_DIR, "cached-function")
+        argv = ["-c", os.path.join(CONFIG_DIR, "cached-function"), "-t", template_dir, "--debug"]
+        try:
+            with self.assertLogs("ionit", level="DEBUG") as context_manager:
+                self.assertEqual(main(argv), 0)
+            with open(os.path.join(template_dir, "netmasks"), encoding="utf-8") as rendered:
+                self.assertEqual(
+                    rendered.read(),
+                    "24 255.255.255.0\n16 255.255.0.0\n24 255.255.255.0\n24 255.255.255.0\n"
+                    "8 255.0.0.0\n16 255.255.0.0\ncalls: 24, 16, 8\n",
+                )
+        finally:
+            os.remove(os.path.join(template_dir, "netmasks"))
+        self.assertIn(
+            "DEBUG:ionit:Cache of function 'netmask': 3 hits, 3 misses, 0 uncacheable calls, "
+            "3 entries (maximum: 16).",
+            context_manager.output,
+        )
+
+
+class TestConfigLoaders(unittest.TestCase):
+    """Test the loaders for static configuration files"""
+
+    def _test_backends(self, loader_class, filename, expected):
+        for backend in loader_class.BACKENDS:
+            loader = loader_class(backend)
+            try:
+                loader.select_backend()
+            except ImportError:
+                continue
+            with self.subTest(backend=backend):
+                self.assertEqual(loader.load(filename, "utf-8"), expected)
+
+    def test_json_backends(self):
+        """Test: Read JSON file with all available backends"""
+        filename = os.path.join(CONFIG_DIR, "static", "first.json")
+        self._test_backends(ionit.JsonLoader, filename, {"first": 1})
+
+    def test_yaml_backends(self):
+        """Test: Read YAML file with all available backends"""
+        filename = os.path.join(CONFIG_DIR, "static", "second.yaml")
+        self._test_backends(ionit.YamlLoader, filename, {"second": 2})
+
+    def test_unavailable_backend(self):
+        """Test: Fail to select an unavailable backend"""
+        loader = ionit.YamlLoader("non-existing")
+        with self.assertRaisesRegex(ImportError, r"^No YAML backend available \(tried non-"):
+            loader.select_backend()
+
+    def test_register_loader(self):
+        """Test: Run collect_context(["tests/config/custom-loader"])"""
+        config_dir = os.path.join(CONFIG_DIR, "custom-loader")
+        self.assertEqual(
+            collect_context([config_dir], "utf-8"), (0, {"answer": "42", "key": "value"})
+        )
+        # The registered loader is dropped when collecting the context again.
+        with self.assertLogs("ionit", level="INFO") as context_manager:
+            self.assertEqual(
+                collect_context([os.path.join(config_dir, "20-data.conf")], "utf-8"), (0, {})
+            )
+        self.assertRegex(context_manager.output[-1], "Skipping configuration file")
+        self.assertEqual(ionit_plugin.CONFIG_LOADERS, {})
+
+    def test_abstract_loaders(self):
+        """Test: Loaders need to implement load() or create_backend()"""
+        with self.assertRaises(TypeError):
+            ionit_plugin.ConfigLoader()  # pylint: disable=abstract-class-instantiated
+        with self.assertRaises(TypeError):
+            ionit.BackendLoader()  # pylint: disable=abstract-class-instantiated
+
+
+class TestContextCache(TemporaryTreeTestCase):
+    """Test caching the parsed content of static configuration files"""
+
+    def setUp(self):
+        super().setUp()
+        self.config_dir = self._mkdir("config")
+        self.cache_filename = os.path.join(self.directory, "cache", "context.pickle")
+        self._write("config/10-first.json", '{"first": 1, "overridden": 1}')
+        self._write("config/20-second.yaml", "second: 2\noverridden: 2\n")
+
+    def _collect(self):
+        cache = ionit.ContextCache(self.cache_filename, "utf-8")
+        cache.load()
+        with self.assertLogs("ionit", level="INFO") as context_manager:
+            failures, context = collect_context([self.config_dir], "utf-8", cache)
+        self.assertEqual(failures, 0)
+        self.assertEqual(cache.save(), 0)
+        return context, [re.sub("'.*/", "'", line) for line in context_manager.output]
+
+    def test_context_cache(self):
+        """Test: Only parse changed configuration files"""
+        context, output = self._collect()
+        self.assertEqual(context, {"first": 1, "second": 2, "overridden": 2})
+        self.assertEqual(
+            output,
+            [
+                "INFO:ionit:Reading configuration file '10-first.json'...",
+                "INFO:ionit:Reading configuration file '20-second.yaml'...",
+            ],
+        )
+
+        context, output = self._collect()
+        self.assertEqual(context, {"first": 1, "second": 2, "overridden": 2})
+        self.assertEqual(
+            output,
+            [
+                "INFO:ionit:Reading configuration file '10-first.json' from cache...",
+                "INFO:ionit:Reading configuration file '20-second.yaml' from cache...",
+            ],
+        )
+
+        self._write("config/10-first.json", '{"first": 10, "overridden": 10}')
+        context, output = self._collect()
+        self.assertEqual(context, {"first": 10, "second": 2, "overridden": 2})
+        self.assertEqual(
+            output,
+            [
+                "INFO:ionit:Reading configuration file '10-first.json'...",
+                "INFO:ionit:Reading configuration file '20-second.yaml' from cache...",
+            ],
+        )
+
+    def test_custom_loader(self):
+        """Test: Do not cache configuration files read by loaders of Python modules"""
+        for name in os.listdir(os.path.join(CONFIG_DIR, "custom-loader")):
+            with open(os.path.join(CONFIG_DIR, "custom-loader", name), encoding="utf-8") as source:
+                self._write(os.path.join("config", name), source.read())
+        for _ in range(2):
+            output = self._collect()[1]
+            self.assertIn("INFO:ionit:Reading configuration file '20-data.conf'...", output)
+
+    def test_broken_cache(self):
+        """Test: Ignore a broken context cache"""
+        os.mkdir(os.path.dirname(self.cache_filename))
+        with open(self.cache_filename, "wb") as cache_file:
+            cache_file.write(b"broken")
+        cache = ionit.ContextCache(self.cache_filename, "utf-8")
+        with self.assertLogs("ionit", level="WARNING") as context_manager:
+            cache.load()
+        self.assertRegex(context_manager.output[0], "^WARNING:ionit:Failed to read context cache")
+        self.assertEqual(cache.entries, {})
+
+
+class TestContextIndex(TemporaryTreeTestCase):
+    """Test loading only the configuration files that provide referenced context"""
+
+    def setUp(self):
+        super().setUp()
+        self.config_dir = self._mkdir("config")
+        self.template_dir = self._mkdir("templates")
+        self.index_filename = os.path.join(self.directory, "index.json")
+        self._write("config/10-a.json", '{"a": 1, "shared": 1}')
+        self._write("config/20-b.yaml", "b: 2\nshared: 2\n")
+        self._write(
+            "config/30-c.py",
+            'REQUIRES = ["a"]\n\n\n'
+            'def collect_context(context):\n    return {"c": context["a"]}\n',
+        )
+        self._write("config/40-d.py", 'def collect_context(context):\n    return {"d": 4}\n')
+        self.files = [
+            os.path.join(self.config_dir, f) for f in sorted(os.listdir(self.config_dir))
+        ]
+
+    def _select(self, index, needed):
+        return [os.path.basename(f) for f in index.select(self.files, needed)]
+
+    def test_select(self):
+        """Test: Select the providing files and the files they require"""
+        index = ionit.ContextIndex(self.index_filename)
+        self.assertEqual(
+            self._select(index, {"b"}), ["10-a.json", "20-b.yaml", "30-c.py", "40-d.py"]
+        )
+        with self.assertLogs("ionit", level="INFO"):
+            self.assertEqual(collect_context([self.config_dir], "utf-8", index=index)[0], 0)
+        self.assertEqual(index.save(), 0)
+
+        index = ionit.ContextIndex(self.index_filename)
+        index.load()
+        self.assertEqual(self._select(index, {"b", "unknown"}), ["20-b.yaml"])
+        self.assertEqual(self._select(index, {"shared"}), ["10-a.json", "20-b.yaml"])
+        self.assertEqual(self._select(index, {"c"}), ["10-a.json", "30-c.py"])
+        self.assertEqual(
+            self._select(index, {"d"}), ["10-a.json", "20-b.yaml", "30-c.py", "40-d.py"]
+        )
+        self._write("config/20-b.yaml", "b: 3\nnew: 3\n")
+        self.assertEqual(self._select(index, {"c"}), ["10-a.json", "20-b.yaml", "30-c.py"])
+
+    def test_main_context_index(self):
+        """Test main() with --context-index"""
+        self._write("templates/b.jinja", "{{ b }} {{ shared }}\n")
+        argv = [
+            "-c",
+            self.config_dir,
+            "-t",
+            self.template_dir,
+            "--context-index",
+            self.index_filename,
+        ]
+        for _ in range(2):
+            with self.assertLogs("ionit", level="INFO") as context_manager:
+                self.assertEqual(main(argv), 0)
+            with open(os.path.join(self.template_dir, "b"), encoding="utf-8") as rendered:
+                self.assertEqual(rendered.read(), "2 2\n")
+        self.assertEqual(
+            [re.sub("'.*/", "'", line) for line in context_manager.output if "config" in line],
+            [
+                "INFO:ionit:Reading configuration file '10-a.json'...",
+                "INFO:ionit:Reading configuration file '20-b.yaml'...",
+            ],
+        )
+
+    def _rendered(self, argv):
+        with self.assertLogs("ionit", level="INFO") as context_manager:
+            self.assertEqual(main(["-c", self.config_dir, "-t", self.template_dir] + argv), 0)
+        return [
+            re.sub("'.*/", "'", line.split(" to ")[0])
+            for line in context_manager.output
+            if line.startswith("INFO:ionit:Rendered")
+        ]
+
+    def test_main_changed_key(self):
+        """Test main() with --changed-key"""
+        self._write("templates/a.jinja", "{{ a }}\n")
+        self._write("templates/b.jinja", "{{ b }}\n")
+        self._write("templates/both.jinja", '{% include "b.jinja" %}{{ a }}\n')
+        self.assertEqual(
+            self._rendered(["--changed-key", "b"]),
+            ["INFO:ionit:Rendered 'b.jinja'", "INFO:ionit:Rendered 'both.jinja'"],
+        )
+        self.assertEqual(self._rendered(["--changed-key", "unused"]), [])
+
+    def test_main_changed_config(self):
+        """Test main() with --changed-config"""
+        self._write("templates/a.jinja", "{{ a }}\n")
+        self._write("templates/b.jinja", "{{ b }}\n")
+        argv = ["--context-index", self.index_filename]
+        changed = argv + ["--changed-config", os.path.join(self.config_dir, "20-b.yaml")]
+        self.assertEqual(len(self._rendered(argv)), 2)
+        # Without recorded values all keys of the changed file are considered changed
+        self.assertEqual(self._rendered(changed), ["INFO:ionit:Rendered 'b.jinja'"])
+        self._write("config/20-b.yaml", "# Only a comment changed\nb: 2\nshared: 2\n")
+        self.assertEqual(self._rendered(changed), [])
+        self._write("config/20-b.yaml", "b: 3\nshared: 2\n")
+        self.assertEqual(self._rendered(changed), ["INFO:ionit:Rendered 'b.jinja'"])
+        with open(os.path.join(self.template_dir, "b"), encoding="utf-8") as rendered:
+            self.assertEqual(rendered.read(), "3\n")
+
+    def test_main_custom_loader(self):
+        """Test main() with --context-index and a Python module that registers a loader"""
+        self._write("templates/answer.jinja", "{{ answer }}\n")
+        argv = ["-c", os.path.join(CONFIG_DIR, "custom-loader"), "-t", self.template_dir]
+        argv += ["--context-index", self.index_filename]
+        for _ in range(2):
+            self.assertEqual(main(argv), 0)
+            with open(os.path.join(self.template_dir, "answer"), encoding="utf-8") as rendered:
+                self.assertEqual(rendered.read(), "42\n")
+            os.remove(os.path.join(self.template_dir, "answer"))
+
+    def test_main_changed_config_sequential(self):
+        """Test main() with --changed-config for two changed files in two runs"""
+        self._write("templates/a.jinja", "{{ a }}\n")
+        self._write("templates/b.jinja", "{{ b }}\n")
+        argv = ["--context-index", self.index_filename]
+        changed_a = argv + ["--changed-config", os.path.join(self.config_dir, "10-a.json")]
+        changed_b = argv + ["--changed-config", os.path.join(self.config_dir, "20-b.yaml")]
+        self.assertEqual(len(self._rendered(argv)), 2)
+        self.assertEqual(self._rendered(changed_a), ["INFO:ionit:Rendered 'a.jinja'"])
+        self.assertEqual(self._rendered(changed_b), ["INFO:ionit:Rendered 'b.jinja'"])
+        self._write("config/10-a.json", '{"a": 5, "shared": 1}')
+        self._write("config/20-b.yaml", "b: 6\nshared: 2\n")
+        self.assertEqual(self._rendered(changed_a), ["INFO:ionit:Rendered 'a.jinja'"])
+        self.assertEqual(self._rendered(changed_b), ["INFO:ionit:Rendered 'b.jinja'"])
+        with open(os.path.join(self.template_dir, "b"), encoding="utf-8") as rendered:
+            self.assertEqual(rendered.read(), "6\n")
+
+    def test_dynamic_include(self):
+        """Test: Load all configuration files if the templates cannot be analysed statically"""
+        with open(
+            os.path.join(self.template_dir, "dynamic.jinja"), "w", encoding="utf-8"
+        ) as template:
+            template.write("{% include name %}\n")
+        finder = ionit.TemplateFinder("jinja")
+        self.assertIsNone(ionit.find_referenced_variables([self.template_dir], finder))
+
+
+class TestCachedContext(TemporaryTreeTestCase):
+    """Test caching the context of Python modules across runs"""
+
+    def setUp(self):
+        super().setUp()
+        self.config_dir = self._mkdir("config")
+        self.cache_dir = os.path.join(self.directory, "cache")
+        self.input_file = self._write("inventory", "a")
+        self._write_plugin(3600)
+        patcher = unittest.mock.patch.object(
+            ionit_plugin, "CONTEXT_CACHE_DIRECTORY", self.cache_dir
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write_plugin(self, ttl):
+        self._write(
+            "config/inventory.py",
+            "import os\n\nimport ionit_plugin\n\n\n"
+            f"@ionit_plugin.cached_context(ttl={ttl}, files=[{self.input_file!r}])\n"
+            "def collect_context(_):\n"
+            "    return {'token': os.urandom(8).hex()}\n",
+        )
+
+    def _collect(self):
+        failures, context = collect_context([self.config_dir], "utf-8")
+        self.assertEqual(failures, 0)
+        return context["token"]
+
+    def test_cached_context(self):
+        """Test: Reuse the cached context until the input files change"""
+        token = self._collect()
+        self.assertEqual(self._collect(), token)
+        self._write(self.input_file, "changed")
+        changed_token = self._collect()
+        self.assertNotEqual(changed_token, token)
+        self.assertEqual(self._collect(), changed_token)
+
+    def test_expired(self):
+        """Test: Do not use expired cache entries"""
+        self._write_plugin(0)
+        self.assertNotEqual(self._collect(), self._collect())
+
+    def test_without_cache_directory(self):
+        """Test: Always call collect_context without cache directory"""
+        with unittest.mock.patch.object(ionit_plugin, "CONTEXT_CACHE_DIRECTORY", None):
+            self.assertNotEqual(self._collect(), self._collect())
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_main_flush(self):
+        """Test main() with --plugin-cache and --flush-plugin-cache"""
+        template_dir = self._mkdir("templates")
+        self._write("templates/token.jinja", "{{ token }}")
+        argv = ["-c", self.config_dir, "-t", template_dir, "--plugin-cache", self.cache_dir]
+        tokens = []
+        for extra_args in ([], [], ["--flush-plugin-cache"]):
+            self.assertEqual(main(argv + extra_args), 0)
+            with open(os.path.join(template_dir, "token"), encoding="utf-8") as token_file:
+                tokens.append(token_file.read())
+        self.assertEqual(tokens[0], tokens[1])
+        self.assertNotEqual(tokens[1], tokens[2])
+
+
 class TestRendering(unittest.TestCase):
     """
     This unittest class tests rendering the templates.
@@ -264,6 +825,60 @@ class TestRendering(unittest.TestCase):
         finally:
             os.remove(os.path.join(template_dir, "Document"))
 
+    def test_render_stream(self):
+        """Test: Stream a large rendered template in chunks and record it in the manifest"""
+        with tempfile.TemporaryDirectory() as template_dir:
+            with open(
+                os.path.join(template_dir, "hosts.jinja"), "w", encoding="utf-8"
+            ) as template_file:
+                template_file.write(
+                    "{% for i in range(count) %}10.0.{{ i // 256 }}.{{ i % 256 }}\n{% endfor %}"
+                )
+            manifest = ionit.Manifest(os.path.join(template_dir, "manifest.json"))
+            renderer = ionit.TemplateRenderer(
+                {"count": 20000}, "jinja", "utf-8", manifest=manifest, stream=True
+            )
+            self.assertEqual(renderer.render_directory(template_dir), 0)
+            template = renderer.get_environment(template_dir).get_template("hosts.jinja")
+            self.assertGreater(len(list(renderer.generate(template))), 1)
+            filename = os.path.join(template_dir, "hosts")
+            with open(filename, encoding="utf-8") as hosts_file:
+                lines = hosts_file.read().splitlines()
+            self.assertEqual((len(lines), lines[0], lines[-1]), (20000, "10.0.0.0", "10.0.78.31"))
+            self.assertTrue(
+                manifest.is_up_to_date(
+                    renderer.get_environment(template_dir), filename, {"count": 20000}
+                )
+            )
+            self.assertEqual(renderer.render_directory(template_dir), 0)
+            self.assertEqual(dict(renderer.stats), {"written": 1, "skipped": 1})
+
+    def test_render_stream_failure(self):
+        """Test: Keep the previous output if rendering fails in the middle of streaming"""
+        with tempfile.TemporaryDirectory() as template_dir:
+            with open(
+                os.path.join(template_dir, "numbers.jinja"), "w", encoding="utf-8"
+            ) as template_file:
+                template_file.write(
+                    "{% for i in range(100000) %}{{ i }}\n{% endfor %}{{ 1 / 0 }}\n"
+                )
+            with open(os.path.join(template_dir, "numbers"), "w", encoding="utf-8") as output_file:
+                output_file.write("old\n")
+            renderer = ionit.TemplateRenderer({}, "jinja", "utf-8", stream=True)
+            with self.assertLogs("ionit", level="ERROR") as context_manager:
+                self.assertEqual(renderer.render_directory(template_dir), 1)
+            self.assertRegex(
+                context_manager.output[0],
+                re.compile(
+                    r"^ERROR:ionit:Failed to render '\S*/numbers.jinja':\n.*\n"
+                    "ZeroDivisionError: division by zero$",
+                    flags=re.DOTALL,
+                ),
+            )
+            self.assertEqual(sorted(os.listdir(template_dir)), ["numbers", "numbers.jinja"])
+            with open(os.path.join(template_dir, "numbers"), encoding="utf-8") as output_file:
+                self.assertEqual(output_file.read(), "old\n")
+
     def test_render_invalid(self):
         """Test: Run render_templates("tests/template/invalid")"""
         template_dir = os.path.join(TEMPLATE_DIR, "invalid")
@@ -280,6 +895,66 @@ class TestRendering(unittest.TestCase):
                 ),
             )
 
+    def test_render_async(self):
+        """Test: Render templates that call coroutine functions concurrently"""
+        called = []
+        all_called = []
+
+        async def wait_for_all(number):
+            # Create the event in the event loop that renders the templates.
+            if not all_called:
+                all_called.append(asyncio.Event())
+            called.append(number)
+            if len(called) == 4:
+                all_called[0].set()
+            await asyncio.wait_for(all_called[0].wait(), 10)
+            return number
+
+        with tempfile.TemporaryDirectory() as template_dir:
+            for number in range(4):
+                template_filename = os.path.join(template_dir, f"{number}.jinja")
+                with open(template_filename, "w", encoding="utf-8") as template_file:
+                    template_file.write(f"{{{{ wait_for_all({number}) }}}}\n")
+            with self.assertLogs("ionit", level="INFO") as context_manager:
+                self.assertEqual(
+                    render_templates(
+                        template_dir, {"wait_for_all": wait_for_all}, "jinja", "utf-8"
+                    ),
+                    0,
+                )
+            for number in range(4):
+                with open(os.path.join(template_dir, str(number)), encoding="utf-8") as rendered:
+                    self.assertEqual(rendered.read(), f"{number}\n")
+        for number, output in enumerate(context_manager.output):
+            self.assertRegex(output, f"^INFO:ionit:Rendered '.*/{number}.jinja' to ")
+
+    def test_render_parallel(self):
+        """Test: Run render_templates() with multiple jobs"""
+        with tempfile.TemporaryDirectory() as template_dir:
+            for number in range(8):
+                content = "{{ 1 // zero }}\n" if number == 5 else f"{number} {{{{ zero }}}}\n"
+                template_filename = os.path.join(template_dir, f"{number}.jinja")
+                with open(template_filename, "w", encoding="utf-8") as template_file:
+                    template_file.write(content)
+            with self.assertLogs("ionit", level="INFO") as context_manager:
+                self.assertEqual(
+                    render_templates(template_dir, {"zero": 0}, "jinja", "utf-8", 4), 1
+                )
+            for number in range(8):
+                rendered_filename = os.path.join(template_dir, str(number))
+                if number == 5:
+                    self.assertFalse(os.path.exists(rendered_filename))
+                    continue
+                with open(rendered_filename, encoding="utf-8") as rendered_file:
+                    self.assertEqual(rendered_file.read(), f"{number} 0\n")
+        self.assertEqual(len(context_manager.output), 8)
+        for number, output in enumerate(context_manager.output):
+            self.assertIn(f"/{number}.jinja'", output)
+        self.assertRegex(
+            context_manager.output[5],
+            re.compile("^ERROR:ionit:Failed to render .*ZeroDivisionError", flags=re.DOTALL),
+        )
+
     def test_render_static(self):
         """Test: Run render_templates("tests/template/static")"""
         template_dir = os.path.join(TEMPLATE_DIR, "static")
@@ -291,6 +966,28 @@ class TestRendering(unittest.TestCase):
         finally:
             os.remove(os.path.join(template_dir, "counting"))
 
+    def test_render_unchanged(self):
+        """Test: Do not rewrite rendered files that have not changed"""
+        template_dir = os.path.join(TEMPLATE_DIR, "static")
+        counting_filename = os.path.join(template_dir, "counting")
+        try:
+            renderer = ionit.TemplateRenderer({"first": "A", "second": "B"}, "jinja", "utf-8")
+            self.assertEqual(renderer.render_directory(template_dir), 0)
+            stat = os.stat(counting_filename)
+            with self.assertLogs("ionit", level="INFO") as context_manager:
+                self.assertEqual(renderer.render_directory(template_dir), 0)
+            self.assertEqual(os.stat(counting_filename).st_mtime_ns, stat.st_mtime_ns)
+            self.assertRegex(context_manager.output[0], r"counting' \(unchanged\)\.$")
+            self.assertEqual(dict(renderer.stats), {"written": 1, "unchanged": 1})
+
+            renderer.context["first"] = "C"
+            self.assertEqual(renderer.render_directory(template_dir), 0)
+            with open(counting_filename, encoding="utf-8") as counting_file:
+                self.assertEqual(counting_file.read(), "Counting:\n* C\n* B\n* 3\n")
+            self.assertEqual(dict(renderer.stats), {"written": 2, "unchanged": 1})
+        finally:
+            os.remove(counting_filename)
+
     def test_render_write_protected(self):
         """Test: Run render_templates("tests/template/static"), but write protected"""
         template_dir = os.path.join(TEMPLATE_DIR, "static")
@@ -310,6 +1007,840 @@ class TestRendering(unittest.TestCase):
                 ),
             )
 
+    def test_render_shared_environment(self):
+        """Test: Include templates from other template directories"""
+        with tempfile.TemporaryDirectory() as directory:
+            template_dirs = [os.path.join(directory, "first"), os.path.join(directory, "second")]
+            files = {
+                "first/hosts.jinja": '{% include "header.inc" %}{% include "macros.inc" %}',
+                "first/header.inc": "first header\n",
+                "second/other.jinja": '{% include "header.inc" %}',
+                "second/header.inc": "second header\n",
+                "second/macros.inc": "{{ host }}\n",
+            }
+            for name, content in files.items():
+                os.makedirs(os.path.join(directory, os.path.dirname(name)), exist_ok=True)
+                with open(os.path.join(directory, name), "w", encoding="utf-8") as output:
+                    output.write(content)
+            renderer = ionit.TemplateRenderer(
+                {"host": "foo"}, "jinja", "utf-8", template_dirs=template_dirs, cache_size=-1
+            )
+            for template_dir in template_dirs:
+                self.assertEqual(renderer.render_directory(template_dir), 0)
+            self.assertIs(
+                renderer.get_environment(template_dirs[0]),
+                renderer.get_environment(template_dirs[1]),
+            )
+            with open(os.path.join(directory, "first/hosts"), encoding="utf-8") as hosts_file:
+                self.assertEqual(hosts_file.read(), "first header\nfoo\n")
+            with open(os.path.join(directory, "second/other"), encoding="utf-8") as other_file:
+                self.assertEqual(other_file.read(), "second header\n")
+
+    def test_template_loader(self):
+        """Test resolving template references with multiple template directories"""
+        first = os.path.join(TEMPLATE_DIR, "static")
+        second = os.path.join(TEMPLATE_DIR, "static2")
+        loader = ionit.TemplateLoader([first, second])
+        parent = ionit.template_name(second, "counting.jinja")
+        self.assertEqual(
+            loader.join_path("counting.jinja", parent),
+            ionit.template_name(second, "counting.jinja"),
+        )
+        self.assertEqual(loader.join_path("missing.inc", parent), "missing.inc")
+        env = ionit.create_environment(loader)
+        self.assertEqual(
+            loader.get_source(env, "counting.jinja")[1], os.path.join(first, "counting.jinja")
+        )
+        self.assertIn(parent, loader.list_templates())
+
+
+class TestManifest(TemporaryTreeTestCase):
+    """Test skipping templates with unchanged inputs"""
+
+    def setUp(self):
+        super().setUp()
+        self.template_dir = self.directory
+        self.manifest_filename = os.path.join(self.template_dir, "manifest.json")
+        self._write("hosts.jinja", '{{ domain }}\n{% include "partial.inc" %}')
+        self._write("partial.inc", "{{ host }}\n")
+
+    def _render(self, context):
+        manifest = ionit.Manifest(self.manifest_filename)
+        manifest.load()
+        renderer = ionit.TemplateRenderer(context, "jinja", "utf-8", manifest=manifest)
+        self.assertEqual(renderer.render_directory(self.template_dir), 0)
+        self.assertEqual(manifest.save(), 0)
+        return dict(renderer.stats)
+
+    def test_skip_unchanged_inputs(self):
+        """Test: Skip templates if the template, includes, and used context did not change"""
+        context = {"domain": "example.com", "host": "foo", "unused": 1}
+        self.assertEqual(self._render(context), {"written": 1})
+        self.assertEqual(self._render(context), {"skipped": 1})
+        context["unused"] = 2
+        self.assertEqual(self._render(context), {"skipped": 1})
+        context["host"] = "bar"
+        self.assertEqual(self._render(context), {"written": 1})
+        self._write("partial.inc", "host: {{ host }}\n")
+        self.assertEqual(self._render(context), {"written": 1})
+        with open(os.path.join(self.template_dir, "hosts"), encoding="utf-8") as hosts_file:
+            self.assertEqual(hosts_file.read(), "example.com\nhost: bar\n")
+
+    def test_modified_output(self):
+        """Test: Render template again if the output was modified"""
+        context = {"domain": "example.com", "host": "foo"}
+        self.assertEqual(self._render(context), {"written": 1})
+        self._write("hosts", "modified\n")
+        self.assertEqual(self._render(context), {"written": 1})
+
+    def test_function_in_context(self):
+        """Test: Never skip templates that call functions from the context"""
+        self._write("partial.inc", "{{ host() }}\n")
+        context = {"domain": "example.com", "host": lambda: "foo"}
+        self.assertEqual(self._render(context), {"written": 1})
+        self.assertEqual(self._render(context), {"unchanged": 1})
+
+    def test_main_force(self):
+        """Test main() with --manifest and --force"""
+        config_dir = os.path.join(CONFIG_DIR, "static")
+        self._write("counting.jinja", "{{ first }} {{ second }}\n")
+        os.remove(os.path.join(self.template_dir, "hosts.jinja"))
+        argv = ["-c", config_dir, "-t", self.template_dir, "--manifest", self.manifest_filename]
+        with self.assertLogs("ionit", level="INFO") as context_manager:
+            self.assertEqual(main(argv), 0)
+            self.assertEqual(main(argv), 0)
+            self.assertEqual(main(argv + ["--force"]), 0)
+        summaries = [line for line in context_manager.output if "Wrote" in line]
+        self.assertEqual(
+            summaries,
+            [
+                "INFO:ionit:Wrote 1 rendered files, left 0 files unchanged, "
+                "skipped 0 templates, failed to render 0 templates.",
+                "INFO:ionit:Wrote 0 rendered files, left 0 files unchanged, "
+                "skipped 1 templates, failed to render 0 templates.",
+                "INFO:ionit:Wrote 0 rendered files, left 1 files unchanged, "
+                "skipped 0 templates, failed to render 0 templates.",
+            ],
+        )
+
+
+class TestTemplateFinder(TemporaryTreeTestCase):
+    """Test searching for templates"""
+
+    def setUp(self):
+        super().setUp()
+        self.template_dir = os.path.join(self.directory, "templates")
+        for name in ("a.jinja", "b.txt", "sub/c.jinja", "sub/deep/d.jinja", "skip/e.jinja"):
+            self._write(os.path.join("templates", name), f"{name}\n")
+
+    def test_find_all(self):
+        """Test: Find all templates (like Jinja's FileSystemLoader)"""
+        self.assertEqual(
+            ionit.TemplateFinder("jinja").find(self.template_dir),
+            ["a.jinja", "skip/e.jinja", "sub/c.jinja", "sub/deep/d.jinja"],
+        )
+
+    def test_exclude_include(self):
+        """Test: Prune excluded directories and only return included templates"""
+        finder = ionit.TemplateFinder("jinja", include=["sub/*"], exclude=["skip", "deep"])
+        self.assertEqual(finder.find(self.template_dir), ["sub/c.jinja"])
+
+    def test_max_depth(self):
+        """Test: Do not descend further than the maximum depth"""
+        finder = ionit.TemplateFinder("jinja", max_depth=0)
+        self.assertEqual(finder.find(self.template_dir), ["a.jinja"])
+        finder = ionit.TemplateFinder("jinja", max_depth=1)
+        self.assertEqual(
+            finder.find(self.template_dir), ["a.jinja", "skip/e.jinja", "sub/c.jinja"]
+        )
+
+    def test_missing_directory(self):
+        """Test: A missing template directory has no templates"""
+        missing = os.path.join(self.template_dir, "missing")
+        self.assertEqual(ionit.TemplateFinder("jinja").find(missing), [])
+
+    def test_index(self):
+        """Test: Use the template index until a directory changes"""
+        filename = os.path.join(self.directory, "index.json")
+        index = ionit.TemplateIndex(filename)
+        finder = ionit.TemplateFinder("jinja", index=index)
+        expected = ["a.jinja", "skip/e.jinja", "sub/c.jinja", "sub/deep/d.jinja"]
+        # Pretend that the directories were modified long ago to trust their modification times
+        for directory in ("", "skip", "sub", "sub/deep"):
+            os.utime(os.path.join(self.template_dir, directory), ns=(10**18, 10**18))
+        self.assertEqual(finder.find(self.template_dir), expected)
+        self.assertEqual(index.save(), 0)
+
+        index = ionit.TemplateIndex(filename)
+        index.load()
+        finder = ionit.TemplateFinder("jinja", index=index)
+        with unittest.mock.patch.object(finder, "scan") as scan:
+            self.assertEqual(finder.find(self.template_dir), expected)
+            scan.assert_not_called()
+        os.remove(os.path.join(self.template_dir, "sub", "deep", "d.jinja"))
+        self.assertEqual(finder.find(self.template_dir), expected[:3])
+        finder = ionit.TemplateFinder("jinja", index=index, max_depth=0)
+        self.assertEqual(finder.find(self.template_dir), ["a.jinja"])
+
+    def test_racy_mtime(self):
+        """Test: Do not trust directory modification times from the time of scanning"""
+        index = ionit.TemplateIndex(os.path.join(self.directory, "index.json"))
+        finder = ionit.TemplateFinder("jinja", index=index)
+        finder.find(self.template_dir)
+        self.assertIsNone(index.get(self.template_dir, finder.options()))
+
+    def test_main_template_list(self):
+        """Test main() with --template-list"""
+        config_dir = os.path.join(CONFIG_DIR, "static")
+        list_filename = os.path.join(self.directory, "templates.list")
+        with open(list_filename, "w", encoding="utf-8") as list_file:
+            list_file.write(
+                f"# Only render one template\n\n{self.template_dir}/sub/c.jinja\n"
+                f"{self.template_dir}/b.txt\n/elsewhere/x.jinja\n"
+            )
+        argv = ["-c", config_dir, "-t", self.template_dir, "--template-list", list_filename]
+        with self.assertLogs("ionit", level="INFO") as context_manager:
+            self.assertEqual(main(argv), 0)
+        self.assertEqual(
+            [line for line in context_manager.output if line.startswith("WARNING")],
+            [
+                f"WARNING:ionit:Ignoring listed template '{self.template_dir}/b.txt', "
+                "because it does not end with '.jinja'.",
+                "WARNING:ionit:Ignoring listed template '/elsewhere/x.jinja', "
+                "because it is not in a template directory.",
+            ],
+        )
+        self.assertTrue(os.path.exists(os.path.join(self.template_dir, "sub", "c")))
+        self.assertFalse(os.path.exists(os.path.join(self.template_dir, "a")))
+
+    def test_main_missing_template_list(self):
+        """Test main() with a missing --template-list file"""
+        missing = os.path.join(self.directory, "missing.list")
+        argv = ["-c", os.path.join(CONFIG_DIR, "static"), "-t", self.template_dir]
+        with self.assertLogs("ionit", level="ERROR"):
+            self.assertEqual(main(argv + ["--template-list", missing]), 1)
+
+
+class TestBytecodeCache(unittest.TestCase):
+    """Test caching the compiled templates"""
+
+    def test_bytecode_cache(self):
+        """Test: Load compiled templates from the bytecode cache"""
+        template_dir = os.path.join(TEMPLATE_DIR, "static")
+        context = {"first": "A", "second": "B"}
+        try:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                for _ in range(2):
+                    bytecode_cache = ionit.BytecodeCache(cache_dir)
+                    renderer = ionit.TemplateRenderer(
+                        context, "jinja", "utf-8", bytecode_cache=bytecode_cache
+                    )
+                    self.assertEqual(renderer.render_directory(template_dir), 0)
+                    self.assertEqual(len(bytecode_cache.used), 1)
+                    self.assertEqual(
+                        [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)],
+                        list(bytecode_cache.used),
+                    )
+        finally:
+            os.remove(os.path.join(template_dir, "counting"))
+
+    def test_main_prune(self):
+        """Test main() with --bytecode-cache and --prune-bytecode-cache"""
+        template_dir = os.path.join(TEMPLATE_DIR, "static")
+        config_dir = os.path.join(CONFIG_DIR, "static")
+        try:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                unused_filename = os.path.join(cache_dir, "__jinja2_unused.cache")
+                other_filename = os.path.join(cache_dir, "other")
+                for filename in (unused_filename, other_filename):
+                    with open(filename, "wb"):
+                        pass
+                argv = ["-c", config_dir, "-t", template_dir, "--bytecode-cache", cache_dir]
+                self.assertEqual(main(argv + ["--prune-bytecode-cache"]), 0)
+                cache_files = os.listdir(cache_dir)
+                self.assertEqual(len(cache_files), 2)
+                self.assertIn("other", cache_files)
+                self.assertNotIn("__jinja2_unused.cache", cache_files)
+        finally:
+            os.remove(os.path.join(template_dir, "counting"))
+
+    def test_main_prune_skipped(self):
+        """Test main() with --prune-bytecode-cache keeping the entries of skipped templates"""
+        with tempfile.TemporaryDirectory() as directory:
+            template_dir = os.path.join(directory, "templates")
+            cache_dir = os.path.join(directory, "cache")
+            os.mkdir(template_dir)
+            for name in ("a.jinja", "b.jinja"):
+                with open(os.path.join(template_dir, name), "w", encoding="utf-8") as template:
+                    template.write('{% include "header.inc" %}{{ first }}\n')
+            with open(os.path.join(template_dir, "header.inc"), "w", encoding="utf-8") as header:
+                header.write("# header\n")
+            argv = ["-c", os.path.join(CONFIG_DIR, "static"), "-t", template_dir]
+            argv += ["--bytecode-cache", cache_dir, "--prune-bytecode-cache"]
+            argv += ["--manifest", os.path.join(directory, "manifest.json")]
+            self.assertEqual(main(argv), 0)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+            self.assertEqual(main(argv), 0)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+            os.remove(os.path.join(template_dir, "b.jinja"))
+            self.assertEqual(main(argv), 0)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+
+class TestCompiledTemplates(TemporaryTreeTestCase):
+    """Test compiling templates ahead of time"""
+
+    def setUp(self):
+        super().setUp()
+        self.template_dir = self._mkdir("templates")
+        self._write("templates/hosts.jinja", '{% include "partial.inc" %}')
+        self._write("templates/partial.inc", "{{ host }}\n")
+
+    def _render(self, compiled):
+        renderer = ionit.TemplateRenderer({"host": "foo"}, "jinja", "utf-8", compiled=compiled)
+        self.assertEqual(renderer.render_directory(self.template_dir), 0)
+        with open(os.path.join(self.template_dir, "hosts"), encoding="utf-8") as hosts_file:
+            return hosts_file.read()
+
+    def _test_compile(self, target):
+        with self.assertLogs("ionit", level="DEBUG") as context_manager:
+            self.assertEqual(ionit.compile_templates([self.template_dir], target, "jinja"), 0)
+            self.assertEqual(self._render(target), "foo\n")
+        self.assertFalse([line for line in context_manager.output if "No up to date" in line])
+
+        self._write("templates/partial.inc", "host: {{ host }}\n")
+        with self.assertLogs("ionit", level="DEBUG") as context_manager:
+            self.assertEqual(self._render(target), "host: foo\n")
+        self.assertIn(
+            "DEBUG:ionit:No up to date precompiled template for 'partial.inc' found.",
+            context_manager.output,
+        )
+
+    def test_compile_directory(self):
+        """Test: Compile templates into a directory and render them"""
+        target = os.path.join(self.directory, "compiled")
+        self._test_compile(target)
+        self.assertEqual(len([f for f in os.listdir(target) if f.endswith(".py")]), 2)
+        self.assertEqual(len(os.listdir(os.path.join(target, "__pycache__"))), 2)
+
+    def test_compile_relocated(self):
+        """Test: Use templates compiled with the template directory at another place"""
+        target = os.path.join(self.directory, "compiled.zip")
+        self.assertEqual(ionit.compile_templates([self.template_dir], target, "jinja"), 0)
+        moved_dir = os.path.join(self.directory, "moved")
+        os.rename(self.template_dir, moved_dir)
+        self.template_dir = moved_dir
+        with self.assertLogs("ionit", level="DEBUG") as context_manager:
+            self.assertEqual(self._render(target), "foo\n")
+        self.assertFalse([line for line in context_manager.output if "No up to date" in line])
+
+    def test_main_compile_exclude(self):
+        """Test main() with --compile only compiling the templates that are rendered"""
+        self._write("templates/skip/broken.jinja", "{% if %}\n")
+        target = os.path.join(self.directory, "compiled")
+        argv = ["-t", self.template_dir, "--exclude", "skip", "--compile", target]
+        with self.assertLogs("ionit", level="INFO"):
+            self.assertEqual(main(argv), 0)
+        self.assertEqual(len([f for f in os.listdir(target) if f.endswith(".py")]), 2)
+
+    def test_compile_replace_directory(self):
+        """Test: Replace the compiled templates of a previous run"""
+        target = os.path.join(self.directory, "compiled")
+        self.assertEqual(ionit.compile_templates([self.template_dir], target, "jinja"), 0)
+        self._write("templates/other.jinja", "other\n")
+        self.assertEqual(ionit.compile_templates([self.template_dir], target, "jinja"), 0)
+        self.assertEqual(len([f for f in os.listdir(target) if f.endswith(".py")]), 3)
+        self.assertEqual(os.listdir(self.directory).count("compiled"), 1)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_compile_refuse_directory(self):
+        """Test: Refuse to replace a directory that contains other files"""
+        target = os.path.join(self.directory, "target")
+        os.mkdir(target)
+        with open(os.path.join(target, "keepme"), "w", encoding="utf-8") as keep_file:
+            keep_file.write("keep me\n")
+        with self.assertLogs("ionit", level="ERROR") as context_manager:
+            self.assertEqual(ionit.compile_templates([self.template_dir], target, "jinja"), 1)
+        self.assertRegex(
+            context_manager.output[0],
+            "^ERROR:ionit:Failed to write compiled templates to '[^']*/target': "
+            "'[^']*/target' exists and does not only contain compiled templates$",
+        )
+        self.assertEqual(os.listdir(target), ["keepme"])
+        self.assertEqual(sorted(os.listdir(self.directory)), ["target", "templates"])
+
+    def test_compile_zip_failure(self):
+        """Test: Remove the temporary zip file if writing the zip file fails"""
+        target = os.path.join(self.directory, "compiled.zip")
+        with unittest.mock.patch("zipfile.ZipFile.write", side_effect=OSError("disk full")):
+            with self.assertLogs("ionit", level="ERROR"):
+                self.assertEqual(ionit.compile_templates([self.template_dir], target, "jinja"), 1)
+        self.assertEqual(os.listdir(self.directory), ["templates"])
+
+    def test_compile_zip(self):
+        """Test: Compile templates into a zip file and render them"""
+        target = os.path.join(self.directory, "compiled.zip")
+        self._test_compile(target)
+        with zipfile.ZipFile(target) as zip_file:
+            self.assertEqual(len(zip_file.namelist()), 4)
+
+    def test_compile_invalid(self):
+        """Test: Compile invalid template"""
+        template_dir = os.path.join(TEMPLATE_DIR, "invalid")
+        target = os.path.join(self.directory, "compiled")
+        with self.assertLogs("ionit", level="ERROR") as context_manager:
+            self.assertEqual(ionit.compile_templates([template_dir], target, "jinja"), 1)
+        self.assertEqual(len(context_manager.output), 1)
+        self.assertRegex(
+            context_manager.output[0],
+            "^ERROR:ionit:Failed to compile template '[^']*template/invalid/invalid.jinja':",
+        )
+
+    def test_main_compile(self):
+        """Test main() with --compile and --compiled-templates"""
+        target = os.path.join(self.directory, "compiled.zip")
+        self.assertEqual(main(["-t", self.template_dir, "--compile", target]), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.template_dir, "hosts")))
+        config_dir = os.path.join(CONFIG_DIR, "function")
+        self._write("templates/partial.inc", "{{ answer_to_all_questions() }}\n")
+        argv = ["-c", config_dir, "-t", self.template_dir, "--compiled-templates", target]
+        self.assertEqual(main(argv), 0)
+        with open(os.path.join(self.template_dir, "hosts"), encoding="utf-8") as hosts_file:
+            self.assertEqual(hosts_file.read(), "42\n")
+
+
+class TestOutputWriter(unittest.TestCase):
+    """Test writing rendered files"""
+
+    def test_atomic_write(self):
+        """Test: Replace file atomically and preserve its permissions"""
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "output")
+            with open(filename, "wb") as output_file:
+                output_file.write(b"old\n")
+            os.chmod(filename, 0o640)
+            inode = os.stat(filename).st_ino
+
+            writer = ionit.OutputWriter(atomic=True, sync="file")
+            self.assertEqual(writer.write(filename, b"new\n"), "written")
+            self.assertEqual(os.listdir(directory), ["output"])
+            self.assertNotEqual(os.stat(filename).st_ino, inode)
+            self.assertEqual(os.stat(filename).st_mode & 0o777, 0o640)
+            with open(filename, "rb") as output_file:
+                self.assertEqual(output_file.read(), b"new\n")
+            self.assertEqual(writer.write(filename, b"new\n"), "unchanged")
+
+    def test_atomic_write_symlink(self):
+        """Test: Atomic writes follow symlinks"""
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "output")
+            os.symlink("target", filename)
+            self.assertEqual(ionit.OutputWriter(atomic=True).write(filename, b"new\n"), "written")
+            self.assertTrue(os.path.islink(filename))
+            with open(os.path.join(directory, "target"), "rb") as output_file:
+                self.assertEqual(output_file.read(), b"new\n")
+
+    def test_atomic_write_failure(self):
+        """Test: Remove temporary file if the atomic write fails"""
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "output")
+            os.mkdir(filename)
+            with self.assertRaises(OSError):
+                ionit.OutputWriter(atomic=True).write(filename, b"new\n")
+            self.assertEqual(os.listdir(directory), ["output"])
+
+    def test_write_stream(self):
+        """Test: Write chunks in place (non-atomic) and detect unchanged content"""
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "output")
+            with open(filename, "wb") as output_file:
+                output_file.write(b"old\n")
+            inode = os.stat(filename).st_ino
+
+            writer = ionit.OutputWriter(sync="file")
+            self.assertEqual(writer.write_stream(filename, [b"new", b"\n"]), "written")
+            self.assertEqual(os.listdir(directory), ["output"])
+            self.assertEqual(os.stat(filename).st_ino, inode)
+            with open(filename, "rb") as output_file:
+                self.assertEqual(output_file.read(), b"new\n")
+            self.assertEqual(writer.write_stream(filename, [b"ne", b"w\n"]), "unchanged")
+            self.assertEqual(os.listdir(directory), ["output"])
+
+    def test_write_stream_failure(self):
+        """Test: Keep the file untouched if producing the chunks fails"""
+
+        def chunks():
+            yield b"partial"
+            raise ValueError("broken")
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "output")
+            with open(filename, "wb") as output_file:
+                output_file.write(b"old\n")
+            for atomic in (False, True):
+                with self.assertRaises(ValueError):
+                    ionit.OutputWriter(atomic=atomic).write_stream(filename, chunks())
+                self.assertEqual(os.listdir(directory), ["output"])
+                with open(filename, "rb") as output_file:
+                    self.assertEqual(output_file.read(), b"old\n")
+
+    def test_sync_filesystem(self):
+        """Test: Flush each affected filesystem once"""
+        with tempfile.TemporaryDirectory() as directory:
+            writer = ionit.OutputWriter(sync="filesystem")
+            for name in ("first", "second"):
+                self.assertEqual(writer.write(os.path.join(directory, name), b"1\n"), "written")
+            self.assertEqual(list(writer.filesystems.values()), [directory])
+            self.assertEqual(writer.sync(), 0)
+            self.assertEqual(writer.filesystems, {})
+
+
+class TestBatchRendering(TemporaryTreeTestCase):
+    """Test rendering the templates for many hosts"""
+
+    def setUp(self):
+        super().setUp()
+        self.config_dir = self._mkdir("config")
+        self.hosts_dir = self._mkdir("hosts")
+        self.template_dir = self._mkdir("templates")
+        self.output_root = os.path.join(self.directory, "output")
+        self._write("config/base.json", '{"domain": "example.com", "role": "web"}')
+        self._write("hosts/alpha.json", '{"host": "alpha"}')
+        self._write("hosts/beta.yaml", "host: beta\nrole: database\n")
+        self._mkdir("hosts/gamma")
+        self._write("hosts/gamma/10-host.json", '{"host": "gamma"}')
+        self._write(
+            "hosts/gamma/20-upper.py",
+            "def collect_context(context):\n"
+            '    return {"host": context["host"].upper() + "." + context["domain"]}\n',
+        )
+        self._write("templates/hostname.jinja", "{{ host }}\n")
+        self._write("templates/sub/role.jinja", "{{ role }}\n")
+
+    def _read(self, host, name):
+        relative_dir = os.path.abspath(self.template_dir).lstrip(os.sep)
+        path = os.path.join(self.output_root, host, relative_dir, name)
+        with open(path, encoding="utf-8") as rendered_file:
+            return rendered_file.read(), os.stat(path).st_ino
+
+    def test_main_hosts(self):
+        """Test main() with --hosts and --output-root"""
+        for jobs in ("1", "3"):
+            with self.subTest(jobs=jobs):
+                argv = ["-c", self.config_dir, "-t", self.template_dir, "-j", jobs]
+                argv += ["--hosts", self.hosts_dir, "--output-root", self.output_root]
+                with self.assertLogs("ionit", level="INFO"):
+                    self.assertEqual(main(argv), 0)
+                self.assertEqual(self._read("alpha", "hostname")[0], "alpha\n")
+                self.assertEqual(self._read("beta", "hostname")[0], "beta\n")
+                self.assertEqual(self._read("gamma", "hostname")[0], "GAMMA.example.com\n")
+                self.assertEqual(self._read("beta", "sub/role")[0], "database\n")
+                alpha_role, alpha_inode = self._read("alpha", "sub/role")
+                gamma_role, gamma_inode = self._read("gamma", "sub/role")
+                self.assertEqual((alpha_role, gamma_role), ("web\n", "web\n"))
+                self.assertEqual(alpha_inode, gamma_inode)
+                self.assertEqual(len(os.listdir(os.path.join(self.output_root, ".objects"))), 5)
+                self.assertFalse(os.path.exists(os.path.join(self.template_dir, "hostname")))
+
+    def test_main_hosts_custom_loader(self):
+        """Test main() with --hosts and a loader registered by the base configuration"""
+        loader = os.path.join(CONFIG_DIR, "custom-loader", "10-loader.py")
+        self._write("hosts/delta/20-data.conf", "host=delta\n")
+        argv = ["-c", self.config_dir, "-c", loader, "-t", self.template_dir]
+        argv += ["--hosts", self.hosts_dir, "--output-root", self.output_root]
+        with self.assertLogs("ionit", level="INFO"):
+            self.assertEqual(main(argv), 0)
+        self.assertEqual(self._read("delta", "hostname")[0], "delta\n")
+
+    def test_prune_objects(self):
+        """Test: Remove objects that are no longer used by any host"""
+        objects_dir = os.path.join(self.output_root, ".objects")
+        os.makedirs(objects_dir)
+        writer = ionit.DedupWriter(objects_dir)
+        filename = os.path.join(self.output_root, "file")
+        self.assertEqual(writer.write(filename, b"old\n"), "written")
+        self.assertEqual(writer.write_stream(filename, [b"ne", b"w\n"]), "written")
+        self.assertEqual(writer.write(filename, b"new\n"), "unchanged")
+        self.assertEqual(writer.prune(), 1)
+        self.assertEqual(len(os.listdir(objects_dir)), 1)
+
+    def test_hosts_without_output_root(self):
+        """Test: --hosts requires --output-root"""
+        with unittest.mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            with self.assertRaises(SystemExit):
+                ionit.parse_args(["--hosts", self.hosts_dir])
+        self.assertIn("--hosts and --output-root", stderr.getvalue())
+
+
+class TestWatcher(TemporaryTreeTestCase):
+    """Test watching the configuration and templates for changes"""
+
+    def setUp(self):
+        super().setUp()
+        self.config_dir = self._mkdir("config")
+        self.template_dir = self._mkdir("templates")
+        self._write("config/context.yaml", "name: world\n")
+        self._write("templates/header.txt", "# header\n")
+        self._write("templates/with-header.jinja", '{% include "header.txt" %}{{ name }}\n')
+        self._write("templates/plain.jinja", "Hello {{ name }}\n")
+        cache = ionit.ContextCache(None, "utf-8")
+        context = collect_context([self.config_dir], "utf-8", cache)[1]
+        self.renderer = ionit.TemplateRenderer(context, "jinja", "utf-8")
+        self.assertEqual(self.renderer.render_directory(self.template_dir), 0)
+        self.watcher = ionit.Watcher(self.renderer, [self.config_dir], [self.template_dir], cache)
+
+    def tearDown(self):
+        self.watcher.inotify.close()
+
+    def _read(self, name):
+        with open(os.path.join(self.template_dir, name), encoding="utf-8") as rendered_file:
+            return rendered_file.read()
+
+    def _process(self):
+        with self.assertLogs("ionit", level="INFO") as context_manager:
+            self.assertEqual(self.watcher.process(self.watcher.wait()), 0)
+        return [re.sub("'[^']*/", "'", line) for line in context_manager.output]
+
+    def test_changed_config(self):
+        """Test: Render all templates again when the configuration changes"""
+        self._write("config/context.yaml", "name: ionit\n")
+        self.assertEqual(
+            self._process(),
+            [
+                "INFO:ionit:Reading configuration file 'context.yaml'...",
+                "INFO:ionit:Rendered 'plain.jinja' to 'plain'.",
+                "INFO:ionit:Rendered 'with-header.jinja' to 'with-header'.",
+            ],
+        )
+        self.assertEqual(self._read("plain"), "Hello ionit\n")
+        self.assertEqual(self._read("with-header"), "# header\nionit\n")
+
+    def test_changed_include(self):
+        """Test: Only render the templates that include a changed file"""
+        self._write("templates/header.txt", "# new header\n")
+        self.assertEqual(
+            self._process(), ["INFO:ionit:Rendered 'with-header.jinja' to 'with-header'."]
+        )
+        self.assertEqual(self._read("with-header"), "# new header\nworld\n")
+
+    def test_watch_searched_directories(self):
+        """Test: Only watch the directories that are searched for templates"""
+        self._mkdir("templates/skip/sub")
+        self._mkdir("templates/one/two")
+        self.renderer.finder = ionit.TemplateFinder("jinja", exclude=["skip"], max_depth=1)
+        self.watcher.inotify.close()
+        self.watcher = ionit.Watcher(self.renderer, [], [self.template_dir], None)
+        self.assertEqual(
+            sorted(self.watcher.inotify.watches.values()),
+            [self.template_dir, os.path.join(self.template_dir, "one")],
+        )
+        self._mkdir("templates/skip/new")
+        self._mkdir("templates/new")
+        self.watcher.process(self.watcher.wait())
+        self.assertEqual(
+            sorted(self.watcher.inotify.watches.values()),
+            [self.template_dir] + [os.path.join(self.template_dir, d) for d in ("new", "one")],
+        )
+
+    def test_new_template(self):
+        """Test: Render templates that are created in a new subdirectory"""
+        self._mkdir("templates/subdir")
+        self.assertEqual(self.watcher.process(self.watcher.wait()), 0)
+        self._write("templates/subdir/new.jinja", "New {{ name }}\n")
+        self.assertEqual(self._process(), ["INFO:ionit:Rendered 'new.jinja' to 'new'."])
+        self.assertEqual(self._read("subdir/new"), "New world\n")
+
+
+class TestRenderServer(TemporaryTreeTestCase):
+    """Test rendering templates on request"""
+
+    def setUp(self):
+        super().setUp()
+        self.config_dir = self._mkdir("config")
+        self.template_dir = self._mkdir("templates")
+        self._write_config("foo")
+        self._write("templates/hosts.jinja", "{{ host }}\n")
+        context = collect_context([self.config_dir], "utf-8")[1]
+        renderer = ionit.TemplateRenderer(
+            context, "jinja", "utf-8", template_dirs=[self.template_dir]
+        )
+        cache = ionit.ContextCache(None, "utf-8")
+        self.server = ionit.RenderServer(renderer, [self.config_dir], cache)
+
+    def _write_config(self, host):
+        self._write("config/host.json", json.dumps({"host": host}))
+
+    def test_render(self):
+        """Test: Render a template from the template directories"""
+        self.assertEqual(
+            self.server.handle({"action": "render", "template": "hosts.jinja"}),
+            {"status": "ok", "output": "foo\n"},
+        )
+        request = {
+            "action": "render",
+            "template": "hosts.jinja",
+            "template_dir": self.template_dir,
+            "context": {"host": "bar"},
+        }
+        self.assertEqual(self.server.handle(request), {"status": "ok", "output": "bar\n"})
+        self.assertFalse(os.path.exists(os.path.join(self.template_dir, "hosts")))
+
+    def test_render_string(self):
+        """Test: Render the given template source"""
+        request = {"action": "render_string", "source": '{% include "hosts.jinja" %}{{ host }}'}
+        self.assertEqual(self.server.handle(request), {"status": "ok", "output": "foo\nfoo"})
+
+    def test_errors(self):
+        """Test: Respond with errors for invalid requests and failing templates"""
+        self.assertEqual(
+            self.server.handle({"action": "render", "template": "missing.jinja"}),
+            {"status": "error", "error": "TemplateNotFound: missing.jinja"},
+        )
+        response = self.server.handle({"action": "render_string", "source": "{{ missing }}"})
+        self.assertEqual(
+            response, {"status": "error", "error": "UndefinedError: 'missing' is undefined"}
+        )
+        self.assertEqual(
+            self.server.handle({"action": "delete"}),
+            {"status": "error", "error": "Unknown action: 'delete'"},
+        )
+        self.assertEqual(
+            json.loads(self.server.handle_line(b"[1]")),
+            {"status": "error", "error": "Invalid request: not a JSON object"},
+        )
+
+    def test_reload(self):
+        """Test: Collect the context again when it is stale or on request"""
+        request = {"action": "render", "template": "hosts.jinja"}
+        self._write_config("bar")
+        self.assertEqual(self.server.handle(request)["output"], "foo\n")
+        self.server.stale = True
+        self.assertEqual(self.server.handle(request)["output"], "bar\n")
+        self._write_config("baz")
+        self.assertEqual(self.server.handle({"action": "reload"}), {"status": "ok", "failures": 0})
+        self.assertEqual(self.server.handle(request)["output"], "baz\n")
+
+    def test_reload_compiled(self):
+        """Test: Load changed precompiled templates again on reload"""
+        target = os.path.join(self.directory, "compiled")
+        self.assertEqual(ionit.compile_templates([self.template_dir], target, "jinja"), 0)
+        self.server.renderer.compiled = target
+        request = {
+            "action": "render",
+            "template": "hosts.jinja",
+            "template_dir": self.template_dir,
+        }
+        self.assertEqual(self.server.handle(request)["output"], "foo\n")
+        self._write("templates/hosts.jinja", "host: {{ host }}\n")
+        self.assertEqual(self.server.handle(request)["output"], "foo\n")
+        with self.assertLogs("ionit", level="INFO"):
+            self.server.handle({"action": "reload"})
+        self.assertEqual(self.server.handle(request)["output"], "host: foo\n")
+
+    def test_connection(self):
+        """Test: Handle multiple requests on one connection"""
+        client, connection = socket.socketpair()
+        thread = threading.Thread(target=self.server.serve_connection, args=(connection,))
+        thread.start()
+        with client, client.makefile("rwb") as stream:
+            stream.write(b'{"action": "render", "template": "hosts.jinja"}\n\n{"action": "x"\n')
+            stream.flush()
+            client.shutdown(socket.SHUT_WR)
+            responses = [json.loads(line) for line in stream]
+        thread.join()
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(responses[0], {"status": "ok", "output": "foo\n"})
+        self.assertEqual(responses[1]["status"], "error")
+
+    def test_client_disconnect(self):
+        """Test: Log a client that disconnects before reading the response"""
+        client, connection = socket.socketpair()
+        with client:
+            client.sendall(b'{"action": "render", "template": "hosts.jinja"}\n')
+        with self.assertLogs("ionit", level="DEBUG") as context_manager:
+            self.server.serve_connection(connection)
+        self.assertIn("Connection failed", context_manager.output[-1])
+
+    def test_run_terminate(self):
+        """Test: Create the socket only accessible by the user and remove it on SIGTERM"""
+        socket_path = os.path.join(self.directory, "ionit.sock")
+        modes = []
+
+        def terminate():
+            while not os.path.exists(socket_path):
+                time.sleep(0.01)
+            modes.append(os.stat(socket_path).st_mode & 0o777)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        thread = threading.Thread(target=terminate)
+        previous_handler = signal.getsignal(signal.SIGTERM)
+        with unittest.mock.patch.object(self.server, "watch_config"):
+            thread.start()
+            with self.assertLogs("ionit", level="INFO"):
+                self.server.run(socket_path)
+        thread.join()
+        self.assertEqual(modes, [0o600])
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertIs(signal.getsignal(signal.SIGTERM), previous_handler)
+
+    def test_serve_with_watch(self):
+        """Test: --serve cannot be combined with --watch"""
+        with unittest.mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            with self.assertRaises(SystemExit):
+                ionit.parse_args(["--serve", "ionit.sock", "--watch"])
+        self.assertIn("argument --serve: not allowed", stderr.getvalue())
+
+
+class TestProfiler(unittest.TestCase):
+    """Test profiling the phases of a run"""
+
+    def setUp(self):
+        self.addCleanup(tracemalloc.stop)
+
+    def test_phases_and_functions(self):
+        """Test: Measure phases and count the calls of exported functions"""
+        profiler = ionit.Profiler()
+        profiler.enable()
+        functions = profiler.instrument({"double": lambda value: 2 * value})
+        with profiler.phase("render"):
+            self.assertEqual([functions["double"](n) for n in range(3)], [0, 2, 4])
+        self.assertEqual([phase[0] for phase in profiler.phases], ["render"])
+        self.assertEqual(profiler.functions["double"][0], 3)
+        output = io.StringIO()
+        profiler.report(output)
+        lines = output.getvalue().splitlines()
+        self.assertRegex(lines[0], "^Phase +Wall +CPU +Peak memory$")
+        self.assertRegex(lines[1], r"^render +[0-9.]+ms +[0-9.]+ms +[0-9.]+KiB$")
+        self.assertRegex(lines[4], r"^double +3 +[0-9.]+ms$")
+
+    def test_disabled(self):
+        """Test: Do not measure anything if profiling is disabled"""
+        profiler = ionit.Profiler()
+        functions = {"double": lambda value: 2 * value}
+        self.assertIs(profiler.instrument(functions), functions)
+        with profiler.phase("render"):
+            pass
+        self.assertEqual(profiler.phases, [])
+
+    @unittest.mock.patch("ionit.PROFILER", ionit.Profiler())
+    def test_main_profile(self):
+        """Test main() with --profile and --profile-dump"""
+        template_dir = os.path.join(TEMPLATE_DIR, "function")
+        argv = ["-c", os.path.join(CONFIG_DIR, "function"), "-t", template_dir, "--profile"]
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                dump = os.path.join(directory, "ionit.pstats")
+                with unittest.mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                    self.assertEqual(main(argv + ["--profile-dump", dump]), 0)
+                stats = pstats.Stats(dump)
+                self.assertTrue(any(key[2] == "run" for key in stats.stats))
+        finally:
+            os.remove(os.path.join(template_dir, "Document"))
+        report = stderr.getvalue()
+        for phase in ("config discovery", "import ", "load ", "render ", "write "):
+            self.assertIn(f"\n{phase}", report)
+        self.assertRegex(report, r"\nanswer_to_all_questions +1 ")
+
 
 class TestMain(unittest.TestCase):
     """Test main function"""
@@ -354,6 +1885,18 @@ class TestMain(unittest.TestCase):
         finally:
             os.remove(os.path.join(template_dir, "counting"))
 
+    def test_main_atomic(self):
+        """Test main() with atomic writes and syncing the filesystem"""
+        template_dir = os.path.join(TEMPLATE_DIR, "static")
+        config_dir = os.path.join(CONFIG_DIR, "static")
+        try:
+            argv = ["-c", config_dir, "-t", template_dir, "--atomic", "--sync", "filesystem"]
+            self.assertEqual(main(argv), 0)
+            with open(os.path.join(template_dir, "counting"), encoding="utf-8") as counting_file:
+                self.assertEqual(counting_file.read(), "Counting:\n* 1\n* 2\n* 3\n")
+        finally:
+            os.remove(os.path.join(template_dir, "counting"))
+
     def test_main_append_templates(self):
         """Test main() with static context and multiple template directories"""
         template_dir1 = os.path.join(TEMPLATE_DIR, "static")
@@ -379,3 +1922,71 @@ class TestMain(unittest.TestCase):
         finally:
             os.remove(os.path.join(template_dir1, "counting"))
             os.remove(os.path.join(template_dir2, "counting"))
+
+    def test_main_cache_size_invalid(self):
+        """Test main() with a --cache-size below -1"""
+        with unittest.mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            with self.assertRaises(SystemExit):
+                main(["--cache-size", "-2"])
+        self.assertIn("--cache-size: must be at least -1", stderr.getvalue())
+
+    def test_main_metrics_file(self):
+        """Test main() with --metrics-file in JSON and node exporter text format"""
+        config_dir = os.path.join(CONFIG_DIR, "static")
+        template_dir = os.path.join(TEMPLATE_DIR, "static")
+        with tempfile.TemporaryDirectory() as directory:
+            json_filename = os.path.join(directory, "metrics.json")
+            textfile = os.path.join(directory, "ionit.prom")
+            argv = ["-c", config_dir, "-t", template_dir]
+            argv += ["--metrics-file", json_filename, "--metrics-file", textfile]
+            try:
+                self.assertEqual(main(argv), 0)
+            finally:
+                os.remove(os.path.join(template_dir, "counting"))
+            with open(json_filename, encoding="utf-8") as metrics_file:
+                metrics = json.load(metrics_file)
+            self.assertEqual(metrics["config_files"], 2)
+            self.assertEqual(metrics["config_cache_hits"], 0)
+            self.assertEqual(metrics["plugins"], 0)
+            self.assertEqual(
+                metrics["templates"], {"written": 1, "unchanged": 0, "skipped": 0, "failed": 0}
+            )
+            self.assertEqual(metrics["bytes_written"], len("Counting:\n* 1\n* 2\n* 3\n"))
+            self.assertEqual(sorted(metrics["phases"]), ["collect_context", "render", "save"])
+            self.assertGreater(metrics["peak_rss_bytes"], 0)
+            with open(textfile, encoding="utf-8") as metrics_file:
+                lines = metrics_file.read().splitlines()
+            self.assertIn('ionit_templates{result="written"} 1', lines)
+            self.assertIn("ionit_config_files 2", lines)
+            self.assertEqual(sorted(os.listdir(directory)), ["ionit.prom", "metrics.json"])
+
+    def test_metrics_peak_rss_workers(self):
+        """Test: Report the peak RSS of the worker processes if it is bigger"""
+        usage = {
+            resource.RUSAGE_SELF: types.SimpleNamespace(ru_maxrss=1000),
+            resource.RUSAGE_CHILDREN: types.SimpleNamespace(ru_maxrss=3000),
+        }
+        with unittest.mock.patch("resource.getrusage", usage.get):
+            metrics = ionit.RunMetrics().to_dict(0)
+        self.assertEqual(metrics["peak_rss_bytes"], 3000 * 1024)
+
+    def test_main_metrics_context_cache(self):
+        """Test main() with --metrics-file counting the configuration files from the cache"""
+        config_dir = os.path.join(CONFIG_DIR, "static")
+        template_dir = os.path.join(TEMPLATE_DIR, "static")
+        with tempfile.TemporaryDirectory() as directory:
+            metrics_filename = os.path.join(directory, "metrics.json")
+            argv = ["-c", config_dir, "-t", template_dir]
+            argv += ["--context-cache", os.path.join(directory, "context.cache")]
+            argv += ["--metrics-file", metrics_filename]
+            try:
+                self.assertEqual(main(argv), 0)
+                os.remove(os.path.join(template_dir, "counting"))
+                self.assertEqual(main(argv), 0)
+            finally:
+                os.remove(os.path.join(template_dir, "counting"))
+            with open(metrics_filename, encoding="utf-8") as metrics_file:
+                metrics = json.load(metrics_file)
+        self.assertEqual(metrics["config_files"], 0)
+        self.assertEqual(metrics["config_cache_hits"], 2)
+        self.assertEqual(metrics["bytes_written"], len("Counting:\n* 1\n* 2\n* 3\n"))
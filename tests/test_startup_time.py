@@ -0,0 +1,95 @@
+# Copyright (C) 2026, Benjamin Drung <bdrung@posteo.de>
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""Check that ionit does not import unneeded modules on start-up."""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IONIT = os.path.join(TOP_DIR, "ionit")
+
+# Modules that are expensive to import and not needed when there is nothing to render
+HEAVY_MODULES = {
+    "concurrent.futures",
+    "hashlib",
+    "jinja2",
+    "json",
+    "orjson",
+    "pickle",
+    "ruamel.yaml",
+    "tempfile",
+    "yaml",
+    "zipfile",
+}
+
+# Generous upper limit for the import time on top of the interpreter start-up (in microseconds)
+IMPORT_TIME_BUDGET = 150000
+
+
+def measure_imports(cmd):
+    """Run the given Python command and return the import times of all modules
+
+    Return a dictionary that maps the module names to their cumulative import
+    time in microseconds (as reported by python -X importtime) and the total
+    import time in microseconds.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + cmd,
+        check=True,
+        cwd=TOP_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    modules = {}
+    total = 0
+    for line in process.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules[name.strip()] = int(cumulative)
+        if not name.startswith("  "):
+            # Only count top-level imports, because the cumulative time includes nested imports
+            total += int(cumulative)
+    return modules, total
+
+
+class TestStartupTime(unittest.TestCase):
+    """Test that the start-up of ionit stays fast"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.baseline = measure_imports(["-c", "pass"])[1]
+
+    def assert_startup(self, cmd):
+        """Assert that no heavy module is imported and the import time is within budget"""
+        modules, total = measure_imports(cmd)
+        self.assertEqual(sorted(HEAVY_MODULES.intersection(modules)), [])
+        self.assertLess(total - self.baseline, IMPORT_TIME_BUDGET)
+
+    def test_help(self):
+        """Test start-up time of ionit --help"""
+        self.assert_startup([IONIT, "--help"])
+
+    def test_nothing_to_render(self):
+        """Test start-up time of a run without configuration and templates"""
+        with tempfile.TemporaryDirectory() as config, tempfile.TemporaryDirectory() as templates:
+            self.assert_startup([IONIT, "-c", config, "-t", templates])
+
+    def test_import(self):
+        """Test start-up time of importing the ionit module"""
+        self.assert_startup(["-c", "import ionit"])